@@ -1,14 +1,37 @@
 import io
+import os
+import socket
+import inspect
+import weakref
+import hashlib
+import marshal
+import sqlite3
+import zlib
+import copy
+import heapq
+import functools
+import bisect
 import sys
+import math
 import multiprocessing
+from multiprocessing import connection
 import traceback
+import threading
 import time
-from tqdm import tqdm as _tqdm
+import pickle
+import warnings
 import queue
-from itertools import count
-from typing import Callable, Any, Union, Tuple, Literal
+from itertools import count, islice
+from collections import OrderedDict, deque
+from concurrent import futures
+from concurrent.futures import as_completed, wait, FIRST_COMPLETED, FIRST_EXCEPTION, ALL_COMPLETED  # noqa: F401, re-exported for Futures.
+from typing import Callable, Any, Union, Tuple, Literal, Iterable, Iterator, AsyncIterable, AsyncIterator, Hashable, TYPE_CHECKING
 from multiprocessing.context import BaseContext
-import tblib.pickling_support as pklex
+from multiprocessing.reduction import ForkingPickler
+from multiprocessing import shared_memory
+
+if TYPE_CHECKING:  # for the annotations only, tqdm is imported on first use, see _tqdm.
+    from tqdm import tqdm
 
 major, minor, patch = 1, 3, 1
 __version_info__ = (major, minor, patch)
@@ -18,6 +41,22 @@ default_context = "spawn"
 ERR_MODE_STR = "str"
 ERR_MODE_EXCEPTION = "exception"
 
+CHUNKSIZE_AUTO = "auto"
+_AUTO_CHUNK_DURATION = 0.02  # seconds of work per chunk that chunksize="auto" aims for.
+_PREFETCH = 2  # fewest messages a worker holds: the one it runs and the next, so that it never waits for the parent.
+_MAX_PREFETCH = 256
+_PREFETCH_DURATION = 0.005  # seconds of work a worker holds, more only delays the tasks that other workers could run.
+_SUBMIT_LINGER = 0.005  # seconds a partial chunk of submit waits for more tasks, see TaskManager._linger
+_WATCHDOG_INTERVAL = 0.05  # seconds between checks of the running tasks, while tasks with a timeout are open.
+_RSS_CHECK_INTERVAL = 0.1  # seconds between checks of a worker's memory use, for max_worker_rss.
+_WORKER_CACHE_SIZE = 256 * 2**20  # bytes, see WorkerContext.cache
+_FUNCTION_REGISTRY_SIZE = 256  # functions kept registered, see function_registry.
+_SCALE_INTERVAL = 0.05  # seconds between the checks of the autoscaler, see TaskManager._scale
+_SCALE_UP_WAIT = 0.1  # seconds that tasks must have waited for a worker before the autoscaler adds workers.
+_HEARTBEATS = 4  # heartbeats a remote worker sends per heartbeat_timeout, see TaskManager._heartbeats
+_TRACE_IDLE_GAP = 1e-4  # seconds between two tasks of a worker from which a trace shows them as idle, see Stats.trace_events
+_RAW, _ZLIB, _LZ4 = b"\x00", b"\x01", b"\x02"  # first byte of the data of a Serializer.
+
 
 class Task(object):
     task_id_counter = count(start=1)
@@ -34,6 +73,50 @@ class Task(object):
             raise TypeError(f"{kwargs} is not a dict")
         self.kwargs = kwargs
         self.id = next(Task.task_id_counter)
+        self.timeout = None
+        self.priority = 0
+        self.affinity = None
+
+    def with_timeout(self, timeout: float) -> "Task":
+        """
+        sets the seconds the task may run, after which its worker is terminated and replaced,
+        and the task fails with TimeoutError. Overrides the task_timeout of the TaskManager, unless None.
+        (keyword arguments of Task go to the function, hence a method.)
+
+            Task(f, 1, 2).with_timeout(5.0)
+
+        returns the task.
+        """
+        if timeout is not None and not timeout > 0:
+            raise ValueError(f"timeout must be positive or None, got {timeout!r}")
+        self.timeout = timeout
+        return self
+
+    def with_priority(self, priority: float) -> "Task":
+        """
+        sets the priority of the task: the TaskManager sends the tasks with the highest priority to the workers first.
+        tasks that wait gain priority over time, see priority_aging of TaskManager.
+
+            Task(f, 1, 2).with_priority(10)
+
+        returns the task.
+        """
+        self.priority = priority
+        return self
+
+    def with_affinity(self, key: Hashable) -> "Task":
+        """
+        sets the affinity key of the task: the TaskManager sends tasks with the same key to the same worker,
+        so that what a worker cached for the key (a loaded model, a parsed file, ...) is reused. While that
+        worker has no room, a worker with nothing to do takes them instead.
+
+            Task(predict, shard_id, rows).with_affinity(shard_id)
+
+        returns the task.
+        """
+        hash(key)  # raises TypeError for unhashable keys.
+        self.affinity = key
+        return self
 
     def __str__(self) -> str:
         return repr(self)
@@ -46,19 +129,27 @@ class Task(object):
 
 
 class TaskChain(object):
-    def __init__(self, task: Task, next_task: Callable[[Task, Any], Union[Task, "TaskChain"]] = None) -> None:
+    def __init__(
+        self, task: Task, next_task: Callable[[Task, Any], Union[Task, "TaskChain"]] = None, resolve_in_worker: bool = False
+    ) -> None:
         """
             allows for promise-like chain execution of tasks, where one task depends on the output of another
-            only supported by TaskManager.execute API, submit/take would have to be implemented manually
+            only supported by TaskManager.execute, imap and run APIs, submit/take would have to be implemented manually
 
             reasoning: sometimes you want multiple steps of tasks executed,
             however, when using .execute API the system would wait for results in a blocking manner
             this API allows you to create a new task that gets queued automatically once the parent task is ready,
             this allows for each of the steps to be executed in a non-blocking manner
+
+            resolve_in_worker: by default every step returns to the parent, which calls next_task and queues the next task.
+            with resolve_in_worker=True, the whole chain is sent to a worker, which runs it to completion
+            and only returns the final result. This saves a round trip per step, but requires next_task
+            (and everything it returns) to be picklable. Such chains can also be submitted.
         """
         self.id = next(Task.task_id_counter)
         self.task = task
         self.next = next_task
+        self.resolve_in_worker = resolve_in_worker
 
         self.task.id = self.id
 
@@ -93,38 +184,816 @@ class TaskChain(object):
                 raise Exception("invalid type")
 
 
+class TaskGraph(object):
+    def __init__(self) -> None:
+        """
+        A directed acyclic graph of tasks, executed by TaskManager.execute_graph.
+
+        A task depends on other tasks of the graph by taking them as arguments (also inside lists, tuples and dicts),
+        they are replaced by their results when the task is sent to a worker. Each task is sent as soon as all its
+        dependencies are done, tasks on the longest remaining (critical) path first, so the workers stay busy
+        instead of waiting for a whole stage to finish:
+
+            g = TaskGraph()
+            parts = [g.add(Task(partial_sum, chunk)) for chunk in chunks]
+            total = g.add(Task(sum, parts))
+            results = tm.execute_graph(g)  # results in the order the tasks were added.
+        """
+        self.tasks: list[Task] = []
+        self.dependencies: dict[int, list[int]] = {}  # task id -> ids of the tasks it depends on.
+        self.costs: dict[int, float] = {}
+        self.keep: dict[int, bool] = {}
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def __repr__(self) -> str:
+        return f"TaskGraph(tasks={len(self.tasks)}, dependencies={sum(len(d) for d in self.dependencies.values())})"
+
+    def add(self, task: Task, after: "Iterable[Task]" = (), cost: float = 1.0, keep_in_worker: bool = False) -> Task:
+        """
+        Adds a task to the graph, tasks of the graph in its arguments become its dependencies.
+
+        REQUIRED
+        --------
+        task: Task
+            Task to add, its dependencies must have been added before.
+
+        OPTIONAL
+        --------
+        after: iterable of Task
+            Additional dependencies, whose results are not passed to the task.
+        cost: float
+            Relative duration of the task, used to find the critical path.
+            Default: 1.0
+        keep_in_worker: bool
+            True: the result stays in shared memory, written by the worker that produced it, and is mapped by
+                the workers running the dependent tasks, without passing through the parent. Its entry in the
+                results of execute_graph is None. Not available on Windows, where it is ignored.
+            Default: False
+
+        returns the task, to be used as argument of dependent tasks.
+        """
+        if not isinstance(task, Task):
+            raise TypeError(f"expected mplite.Task, not {type(task)}")
+        if task.id in self.dependencies:
+            raise ValueError(f"{task} is already part of the graph")
+
+        dependencies = {}  # ordered set.
+        for t in [*_find_tasks((task.args, task.kwargs)), *after]:
+            if t.id not in self.dependencies:
+                raise ValueError(f"{t} is not part of the graph, add it before the tasks depending on it")
+            dependencies[t.id] = None
+
+        self.tasks.append(task)
+        self.dependencies[task.id] = list(dependencies)
+        self.costs[task.id] = cost
+        self.keep[task.id] = keep_in_worker and os.name != "nt"
+        return task
+
+    def _prepare(self, task: Task, values: "dict[int, Any]") -> Task:
+        """ returns a copy of task, whose dependencies are replaced by their results """
+        prepared = copy.copy(task)
+        args, kwargs = _substitute(task.args, values), _substitute(task.kwargs, values)
+        if self.keep[task.id]:
+            prepared.f, prepared.args, prepared.kwargs = _keep_in_worker, (task.f, args, kwargs), {}
+        else:
+            prepared.args, prepared.kwargs = args, kwargs
+        return prepared
+
+
+def _find_tasks(obj) -> "list[Task]":
+    """ finds the tasks in obj, and in the tuples, lists and dicts it contains """
+    t = type(obj)
+    if isinstance(obj, Task):
+        return [obj]
+    if t is tuple or t is list:
+        return [task for o in obj for task in _find_tasks(o)]
+    if t is dict:
+        return [task for o in obj.values() for task in _find_tasks(o)]
+    return []
+
+
+def _substitute(obj, values: "dict[int, Any]"):
+    """ replaces the tasks in obj, and in the tuples, lists and dicts it contains, by their results """
+    t = type(obj)
+    if isinstance(obj, Task):
+        value = values[obj.id]
+        return _SharedArgument(value) if type(value) is _SharedPayload else value
+    if t is tuple or t is list:
+        return t(_substitute(o, values) for o in obj)
+    if t is dict:
+        return {k: _substitute(v, values) for k, v in obj.items()}
+    return obj
+
+
+def _keep_in_worker(f: Callable, args: tuple, kwargs: dict, *, ctx: "WorkerContext" = None) -> "_SharedPayload":
+    """ executed by the worker for TaskGraph tasks with keep_in_worker=True """
+    if ctx is not None and "ctx" not in kwargs and _context_position(f) >= len(args):
+        kwargs = {**kwargs, "ctx": ctx}
+    return _SharedPayload.dumps(f(*args, **kwargs), threshold=1, keep=True)
+
+
+class Future(futures.Future):
+    def __init__(self, task_id: int, manager: "TaskManager" = None) -> None:
+        """
+        The eventual result of a Task submitted with TaskManager.submit, identified by task_id (== Task.id).
+
+        Supports the concurrent.futures.Future API: result(timeout), exception(timeout), done(), add_done_callback(fn),
+        and works with mplite.as_completed / mplite.wait (which are concurrent.futures.as_completed / wait).
+
+        Once the result is asked for (or a callback is added), the future is considered claimed:
+        TaskManager.take will no longer return its result.
+        Callbacks run in the TaskManager's collector thread, so they should be quick.
+
+        cancel() cancels the task, see TaskManager.cancel: the future then raises CancelledError.
+        """
+        super().__init__()
+        self.task_id = task_id
+        self._manager = manager
+        self._owner = manager  # unlike _manager, kept after the future is claimed.
+
+    def __repr__(self) -> str:
+        return f"<Future task_id={self.task_id} {super().__repr__()[1:-1]}>"
+
+    def _claim(self):
+        manager, self._manager = self._manager, None
+        if manager is not None:
+            manager._claim(self.task_id)
+
+    def result(self, timeout=None):
+        self._claim()
+        return super().result(timeout)
+
+    def exception(self, timeout=None):
+        self._claim()
+        return super().exception(timeout)
+
+    def add_done_callback(self, fn):
+        self._claim()
+        return super().add_done_callback(fn)
+
+    def done(self):
+        if self._owner is not None and self._owner._submitted:  # polled: a partial chunk must not wait for more tasks.
+            self._owner._flush_submitted()
+        return super().done()
+
+    def running(self):
+        if self._owner is not None and self._owner._submitted:
+            self._owner._flush_submitted()
+        return super().running()
+
+    def cancel(self):
+        if self._owner is None or self.done():
+            return False
+        return self._owner.cancel(self.task_id)
+
+
+class LRUCache(object):
+    def __init__(self, max_size: int) -> None:
+        """
+        A cache that evicts the least recently used entries once the total size of its values exceeds max_size bytes.
+
+        The size of a value is its nbytes (numpy arrays, memoryview), or else sys.getsizeof, which does not
+        count the objects that a container refers to: pass the size to put for those.
+
+            cache.get_or_compute(path, lambda: parse(path))
+        """
+        self.max_size = max_size
+        self.size = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()  # key -> (value, size), least recent first.
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, value, size: int = None):
+        """ caches value, unless it is larger than the cache, and evicts the least recently used values that no longer fit. """
+        if size is None:
+            nbytes = getattr(value, "nbytes", None)
+            size = nbytes if type(nbytes) is int else sys.getsizeof(value)
+        self.pop(key)
+        if size > self.max_size:
+            return
+        self._entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= evicted
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], size: int = None):
+        """ returns the cached value of key, or caches and returns the result of compute(). """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry[0]
+        value = compute()
+        self.put(key, value, size)
+        return value
+
+    def pop(self, key: Hashable, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self.size -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+
+class ResultCache(object):
+    def __init__(self, max_size: int = 256 * 2**20, path: str = None, max_disk_size: int = 2**30) -> None:
+        """
+        Results of tasks by a hash of their function (its qualified name, for lambdas and local functions
+        also its code, closure and defaults) and pickled arguments, see result_cache
+        of TaskManager. Only use it for functions whose result depends on their arguments alone.
+
+        OPTIONAL
+        --------
+        max_size: int
+            Bytes of pickled results kept in memory, the least recently used are evicted first.
+            Default: 256 MiB
+        path: str | None
+            None: (default) results are kept in memory only.
+            str: SQLite database file in which the results are kept as well, across runs.
+        max_disk_size: int
+            Bytes of pickled results kept in the database, the least recently used are evicted first.
+            Default: 1 GiB
+        """
+        self.memory = LRUCache(max_size)  # key -> pickled result, so that every hit gets its own copy.
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self._lock = threading.Lock()  # results are looked up by the callers and stored by the collector.
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+
+    @staticmethod
+    def key(task: Task) -> Union[bytes, None]:
+        """ sha256 of the task's function and pickled arguments, None if they cannot be pickled. """
+        f = task.f
+        try:
+            if inspect.isbuiltin(f) or (inspect.isfunction(f) and f.__closure__ is None and "<lambda>" not in f.__qualname__ and "<locals>" not in f.__qualname__):
+                digest = hashlib.sha256(f"{f.__module__}.{f.__qualname__}".encode())  # pickled by name anyway.
+            elif inspect.isfunction(f):  # lambdas and local functions share their names: their code, closure and defaults count.
+                digest = hashlib.sha256(f"{f.__module__}.{f.__qualname__}".encode())
+                digest.update(marshal.dumps(f.__code__))
+                closure = [cell.cell_contents for cell in f.__closure__ or ()]
+                digest.update(pickle.dumps((closure, f.__defaults__, f.__kwdefaults__), protocol=4))
+            else:  # partials, callable objects: their state counts as well.
+                digest = hashlib.sha256(pickle.dumps(f, protocol=4))
+            digest.update(pickle.dumps((task.args, task.kwargs), protocol=4))
+        except Exception:
+            return None
+        return digest.digest()
+
+    def get(self, key: bytes) -> "Tuple[bool, Any]":
+        """ returns (True, result) for a cached result, (False, None) otherwise. """
+        with self._lock:
+            blob = self.memory.get(key)
+            if blob is None and self._db is not None:
+                row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    blob = row[0]
+                    self._db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+                    self.memory.put(key, blob, len(blob))
+        if blob is None:
+            return False, None
+        return True, pickle.loads(blob)
+
+    def put(self, key: bytes, result) -> Union[bytes, None]:
+        """ caches result, returns it pickled, or None if it cannot be pickled (it is not cached then). """
+        try:
+            blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return None
+        with self._lock:
+            self.memory.put(key, blob, len(blob))
+            if self._db is not None and len(blob) <= self.max_disk_size:
+                # other processes may share the database: its size is read in the transaction that evicts.
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, blob, len(blob), time.time()))
+                    disk_size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+                    while disk_size > self.max_disk_size:
+                        for old, size in self._db.execute("SELECT key, size FROM results WHERE key != ? ORDER BY used LIMIT 64", (key,)).fetchall():
+                            self._db.execute("DELETE FROM results WHERE key = ?", (old,))
+                            disk_size -= size
+                            if disk_size <= self.max_disk_size:
+                                break
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+        return blob
+
+    def clear(self):
+        with self._lock:
+            self.memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+
+    def close(self):
+        """ closes the database, the results in memory remain available. """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class Serializer(object):
+    def __init__(
+        self,
+        protocol: int = pickle.HIGHEST_PROTOCOL,
+        cloudpickle: bool = False,
+        compression: Literal[None, "zlib", "lz4", "auto"] = None,
+        compression_threshold: int = 64 * 1024,
+    ) -> None:
+        """
+        How functions, arguments and results travel between the TaskManager and its workers, see serializer of TaskManager.
+
+        OPTIONAL
+        --------
+        protocol: int
+            Pickle protocol.
+            Default: pickle.HIGHEST_PROTOCOL
+        cloudpickle: bool
+            False: (default) objects that pickle cannot serialize raise.
+            True: cloudpickle serializes those instead, e.g. lambdas and functions defined inside functions.
+                Requires cloudpickle.
+        compression: None | 'zlib' | 'lz4' | 'auto'
+            None: (default) no compression.
+            'zlib' | 'lz4': payloads of at least compression_threshold bytes are compressed, if that makes them smaller.
+                lz4 (requires the lz4 package) is several times faster, zlib compresses a bit better.
+            'auto': lz4 if it is installed, zlib otherwise.
+        compression_threshold: int
+            Bytes from which payloads are compressed.
+            Default: 64 KiB
+        """
+        if compression == "auto":
+            compression = "lz4" if _lz4() is not None else "zlib"
+        if compression not in (None, "zlib", "lz4"):
+            raise ValueError(f"compression must be None, 'zlib', 'lz4' or 'auto', got {compression!r}")
+        if compression == "lz4" and _lz4() is None:
+            raise ImportError("compression='lz4' requires the lz4 package.")
+        if cloudpickle:
+            import cloudpickle as _  # noqa: F401, raises here rather than with the first lambda.
+        self.protocol = protocol
+        self.cloudpickle = cloudpickle
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+
+    def __repr__(self) -> str:
+        return f"Serializer(protocol={self.protocol}, cloudpickle={self.cloudpickle}, compression={self.compression!r}, compression_threshold={self.compression_threshold})"
+
+    def dumps(self, obj) -> bytes:
+        buffer = io.BytesIO()
+        buffer.write(_RAW)  # the first byte tells how the rest is compressed.
+        try:
+            pickle.dump(obj, buffer, self.protocol)
+        except Exception:
+            if not self.cloudpickle:
+                raise
+            import cloudpickle
+            buffer.seek(1)
+            buffer.truncate()
+            cloudpickle.dump(obj, buffer, self.protocol)
+
+        if self.compression is None or buffer.tell() - 1 < self.compression_threshold:
+            return buffer.getvalue()
+        with buffer.getbuffer() as view:
+            if self.compression == "zlib":
+                compressed = _ZLIB + zlib.compress(view[1:], 1)  # the fastest level gets most of the gain on text-like data.
+            else:
+                compressed = _LZ4 + _lz4().compress(view[1:])
+            if len(compressed) < len(view):
+                return compressed
+        return buffer.getvalue()
+
+    def loads(self, data: bytes):
+        with memoryview(data) as view:
+            codec, body = data[:1], view[1:]
+            if codec == _ZLIB:
+                body = zlib.decompress(body)
+            elif codec == _LZ4:
+                body = _lz4().decompress(body)
+            return pickle.loads(body)
+
+
+class WorkerContext(object):
+    def __init__(self, name: str, cache_size: int = _WORKER_CACHE_SIZE) -> None:
+        """
+        The state of a worker process, passed to the tasks (and worker_init) whose function has a
+        `ctx: WorkerContext` parameter (the annotation is required):
+
+            def predict(rows, ctx: WorkerContext):
+                model = ctx.cache.get_or_compute("model", lambda: load_model(ctx.state["path"]))
+                return model.predict(rows)
+
+        name: str
+            Name of the worker.
+        state: Any
+            The return value of worker_init, None without worker_init.
+        cache: LRUCache
+            Cache of the worker, see TaskManager's worker_cache_size.
+        """
+        self.name = name
+        self.state = None
+        self.cache = LRUCache(cache_size)
+
+    def __repr__(self) -> str:
+        return f"WorkerContext(name={self.name!r}, state={self.state!r}, cache={len(self.cache)} entries)"
+
+
+class TaskStats(object):
+    __slots__ = ("task_id", "name", "chained", "worker", "enqueued", "sent", "started", "ended", "received", "sent_bytes", "received_bytes", "dumps", "loads")
+
+    def __init__(self, task_id: int, enqueued: float, name: str = None, chained: bool = False) -> None:
+        """
+        The timeline of a task, see TaskManager.stats. Times are time.monotonic() seconds: enqueued (by execute,
+        submit, ...), sent (to a worker's queue), started and ended (by the worker, on the worker's clock), received
+        (the result, by the parent). sent_bytes / received_bytes are the sizes of the pickled task and result, and
+        dumps / loads the seconds the parent spent pickling and unpickling them. A chunk's sizes and seconds are
+        shared evenly among its tasks. None where unknown, e.g. sizes for the thread and inline backends.
+        name is the qualified name of the task's function, chained is True for a step of a TaskChain whose next
+        step the parent queues, under the same task id.
+        """
+        self.task_id = task_id
+        self.name = name
+        self.chained = chained
+        self.worker: str = None
+        self.enqueued = enqueued
+        self.sent = self.started = self.ended = self.received = None
+        self.sent_bytes = self.received_bytes = self.dumps = self.loads = None
+
+    def __repr__(self) -> str:
+        return f"TaskStats({', '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__)})"
+
+    @property
+    def queue_wait(self) -> float:
+        """ seconds the task waited for a worker with room for it: scheduling. """
+        return self.sent - self.enqueued
+
+    @property
+    def worker_wait(self) -> float:
+        """ seconds from sending the task until the worker started it: IPC, and the tasks the worker held before it. """
+        return self.started - self.sent
+
+    @property
+    def execution(self) -> float:
+        """ seconds the worker ran the task: compute. """
+        return self.ended - self.started
+
+    @property
+    def result_wait(self) -> float:
+        """ seconds from the end of the task until the parent received its result: IPC, and the rest of a chunk. """
+        return self.received - self.ended
+
+    @property
+    def total(self) -> float:
+        return self.received - self.enqueued
+
+
+class Stats(object):
+    METRICS = ("queue_wait", "worker_wait", "execution", "result_wait", "total", "sent_bytes", "received_bytes", "dumps", "loads")
+
+    def __init__(self, max_tasks: int = 100_000) -> None:
+        """
+        Telemetry of a TaskManager(telemetry=True), see TaskManager.stats:
+
+            print(tm.stats)  # percentiles of the task timings and sizes, and how busy the workers were.
+
+        tasks: deque[TaskStats]
+            The timelines of the last max_tasks tasks whose results were received.
+        """
+        self.tasks: "deque[TaskStats]" = deque(maxlen=max_tasks)
+        self.open: "dict[int, TaskStats]" = {}  # task id -> timeline, until the result is received.
+        self.busy: "dict[str, float]" = {}  # worker name -> seconds spent running tasks.
+        self.counts: "dict[str, int]" = {}  # worker name -> tasks run.
+        self.alive: "dict[str, float]" = {}  # worker name -> seconds the workers of that name were ready, until now.
+        self.ready: "dict[str, float]" = {}  # worker name -> time.monotonic() when the running worker became ready.
+        # [name, pid, worker_init started, ready (worker_init ended), stopped] of each worker process, see trace_events.
+        self.processes: "deque[list]" = deque(maxlen=max_tasks)
+        self.names: "dict[int, Tuple[str, bool]]" = {}  # task id -> (name, chained) until the task is queued, see TaskManager._encode
+
+    def __repr__(self) -> str:
+        return f"Stats({len(self.tasks)} tasks, {len(self.busy)} workers)"
+
+    def __str__(self) -> str:
+        lines = [f"{'metric':<15}{'count':>9}{'mean':>12}{'p50':>12}{'p90':>12}{'p99':>12}{'max':>12}"]
+        for metric, s in self.summary().items():
+            lines.append(f"{metric:<15}{s['count']:>9}" + "".join(f"{s[k]:>12.6g}" for k in ("mean", "p50", "p90", "p99", "max")))
+        lines.append(f"{'worker':<15}{'tasks':>9}{'busy':>12}{'idle':>12}{'utilization':>12}")
+        for name, w in sorted(self.workers().items()):
+            lines.append(f"{name:<15}{w['tasks']:>9}{w['busy']:>12.6g}{w['idle']:>12.6g}{w['utilization']:>12.1%}")
+        return "\n".join(lines)
+
+    def values(self, metric: str) -> "list[float]":
+        """ the values of a metric (see METRICS) over the recorded tasks that have it. """
+        if metric not in self.METRICS:
+            raise ValueError(f"metric must be one of {self.METRICS}, got {metric!r}")
+        values = []
+        for t in list(self.tasks):
+            try:
+                value = getattr(t, metric)
+            except TypeError:  # a time is missing, e.g. the task was answered by the result_cache.
+                continue
+            if value is not None:
+                values.append(value)
+        return values
+
+    def percentile(self, metric: str, q: float) -> Union[float, None]:
+        """ the q-th percentile (0 <= q <= 100) of a metric, linearly interpolated. None without values. """
+        return _percentile(sorted(self.values(metric)), q)
+
+    def summary(self) -> "dict[str, dict[str, float]]":
+        """ {metric: {"count", "mean", "p50", "p90", "p99", "max"}} for the metrics with values. """
+        summary = {}
+        for metric in self.METRICS:
+            values = sorted(self.values(metric))
+            if values:
+                summary[metric] = {
+                    "count": len(values),
+                    "mean": sum(values) / len(values),
+                    **{f"p{q}": _percentile(values, q) for q in (50, 90, 99)},
+                    "max": values[-1],
+                }
+        return summary
+
+    def workers(self) -> "dict[str, dict[str, float]]":
+        """ {worker name: {"tasks", "busy", "idle" (seconds), "utilization" (busy / time ready)}} """
+        now = time.monotonic()
+        workers = {}
+        for name in set(self.busy) | set(self.ready) | set(self.alive):
+            alive = self.alive.get(name, 0.0) + (now - self.ready[name] if name in self.ready else 0.0)
+            busy = self.busy.get(name, 0.0)
+            workers[name] = {"tasks": self.counts.get(name, 0), "busy": busy, "idle": max(alive - busy, 0.0), "utilization": busy / alive if alive > 0 else 0.0}
+        return workers
+
+    def clear(self):
+        self.tasks.clear()
+        self.open.clear()
+        self.busy.clear()
+        self.counts.clear()
+        self.alive.clear()
+        now = time.monotonic()
+        self.ready = {name: now for name in self.ready}
+        running = [p for p in self.processes if p[4] is None]
+        self.processes.clear()
+        self.processes.extend(running)
+
+    def trace_events(self) -> "list[dict]":
+        """
+        The recorded tasks as Chrome trace events (see write_trace): one track per worker process with its
+        worker_init, its tasks (named after their function) and the idle gaps between them, flow arrows from
+        each step of a TaskChain to the next, and counters of the tasks waiting for a worker and in the workers.
+        """
+        tasks = sorted((t for t in list(self.tasks) if t.started is not None), key=lambda t: t.started)
+        processes = sorted(list(self.processes), key=lambda p: p[3])
+        times = [t.enqueued for t in tasks] + [p[2] if p[2] is not None else p[3] for p in processes]
+        origin = min(times) if times else 0.0
+
+        def us(seconds: float) -> float:
+            return round((seconds - origin) * 1e6, 3)
+
+        events = [{"ph": "M", "name": "process_name", "pid": 0, "tid": 0, "args": {"name": "mplite"}}]
+        tracks: "dict[str, list]" = {}  # worker name -> [(ready, tid)] of its processes.
+        for tid, (name, pid, init_started, ready, _) in enumerate(processes, start=1):
+            tracks.setdefault(name, []).append((ready, tid))
+            label = f"worker {name}" if pid is None else f"worker {name} (pid {pid})"
+            events.append({"ph": "M", "name": "thread_name", "pid": 0, "tid": tid, "args": {"name": label}})
+            events.append({"ph": "M", "name": "thread_sort_index", "pid": 0, "tid": tid, "args": {"sort_index": tid}})
+            if init_started is not None:
+                events.append({"ph": "X", "name": "worker_init", "cat": "init", "pid": 0, "tid": tid, "ts": us(init_started), "dur": us(ready) - us(init_started)})
+
+        def track(t: TaskStats) -> int:
+            """ the process of the worker that ran t: the last one of its name that was ready before t started. """
+            if t.worker not in tracks:  # recorded before clear, or a worker the processes no longer hold.
+                tracks[t.worker] = [(-math.inf, len(tracks) + len(processes) + 1)]
+                tid = tracks[t.worker][0][1]
+                events.append({"ph": "M", "name": "thread_name", "pid": 0, "tid": tid, "args": {"name": f"worker {t.worker}"}})
+            candidates = tracks[t.worker]
+            return candidates[max(bisect.bisect_right(candidates, (t.started, math.inf)) - 1, 0)][1]
+
+        busy_until: "dict[int, float]" = {tid: ready for ready, tid in (c for cs in tracks.values() for c in cs)}
+        steps: "dict[int, Tuple[TaskStats, int]]" = {}  # task id -> last chained step and its track.
+        for t in tasks:
+            tid = track(t)
+            idle_since = busy_until.get(tid, t.started)
+            if t.started - idle_since >= _TRACE_IDLE_GAP:
+                events.append({"ph": "X", "name": "idle", "cat": "idle", "pid": 0, "tid": tid, "ts": us(idle_since), "dur": us(t.started) - us(idle_since)})
+            busy_until[tid] = max(idle_since, t.ended)
+            args = {"task_id": t.task_id, **{m: getattr(t, m) for m in ("queue_wait", "worker_wait", "result_wait")}}
+            args.update((k, getattr(t, k)) for k in ("sent_bytes", "received_bytes") if getattr(t, k) is not None)
+            events.append({"ph": "X", "name": t.name or "task", "cat": "task", "pid": 0, "tid": tid, "ts": us(t.started), "dur": us(t.ended) - us(t.started), "args": args})
+            previous = steps.pop(t.task_id, None)
+            if previous is not None:  # the arrow binds to the slices that enclose its ends.
+                flow = {"name": "TaskChain", "cat": "chain", "id": len(events), "pid": 0}
+                events.append({**flow, "ph": "s", "tid": previous[1], "ts": us(previous[0].started)})
+                events.append({**flow, "ph": "f", "bp": "e", "tid": tid, "ts": us(t.started)})
+            if t.chained:
+                steps[t.task_id] = (t, tid)
+        for tid, (name, pid, init_started, ready, stopped) in enumerate(processes, start=1):
+            if stopped is not None and stopped - busy_until[tid] >= _TRACE_IDLE_GAP:
+                events.append({"ph": "X", "name": "idle", "cat": "idle", "pid": 0, "tid": tid, "ts": us(busy_until[tid]), "dur": us(stopped) - us(busy_until[tid])})
+
+        changes = []  # (time, waiting, in workers) deltas, to find the stalls where tasks wait while workers idle.
+        for t in tasks:
+            if t.sent is not None and t.received is not None:
+                changes += [(t.enqueued, 1, 0), (t.sent, -1, 1), (t.received, 0, -1)]
+        waiting = in_workers = 0
+        for when, w, r in sorted(changes):
+            waiting, in_workers = waiting + w, in_workers + r
+            events.append({"ph": "C", "name": "tasks", "pid": 0, "tid": 0, "ts": us(when), "args": {"waiting": waiting, "in workers": in_workers}})
+        return events
+
+    def write_trace(self, path: str):
+        """
+        Writes the recorded tasks to a Chrome trace event file, to see them on a timeline in https://ui.perfetto.dev
+        or chrome://tracing, see trace_events and TaskManager(trace=...).
+        Remote workers record their times on their own clock, their tracks may be shifted against the others.
+        """
+        import json  # only needed for a trace.
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, f)
+
+    def _started(self, name: str, pid: int = None, init_started: float = None, ready: float = None):
+        """ a worker became ready, with the pid of its process and the times it ran worker_init, if known. """
+        now = time.monotonic()
+        self.ready[name] = now
+        self.processes.append([name, pid, init_started, now if ready is None else ready, None])
+
+    def _stopped(self, name: str):
+        now = time.monotonic()
+        since = self.ready.pop(name, None)
+        if since is not None:
+            self.alive[name] = self.alive.get(name, 0.0) + now - since
+        for process in reversed(self.processes):
+            if process[0] == name:
+                if process[4] is None:
+                    process[4] = now
+                break
+
+    def _enqueued(self, message: Union[tuple, list], now: float):
+        for task_id in _message_ids(message):
+            if task_id not in self.open:  # a retry keeps its first time.
+                self.open[task_id] = TaskStats(task_id, now, *self.names.pop(task_id, (None, False)))
+
+    def _sent(self, message: Union[tuple, list], name: str, size: int = None, dumps: float = None):
+        ids = _message_ids(message)
+        now = time.monotonic()
+        for task_id in ids:
+            t = self.open.get(task_id)
+            if t is not None:
+                t.sent, t.worker = now, name
+                if size is not None:
+                    t.sent_bytes, t.dumps = size / len(ids), dumps / len(ids)
+
+    def _received(self, name: str, timings: "list[Tuple[int, float, float]]", size: int = None, loads: float = None):
+        """ timings: [(task id, started, ended)] of the tasks of a result message, from the worker. """
+        now = time.monotonic()
+        for task_id, started, ended in timings:
+            t = self.open.pop(task_id, None)
+            if t is None:
+                continue
+            t.started, t.ended, t.received, t.worker = started, ended, now, name
+            if size is not None:
+                t.received_bytes, t.loads = size / len(timings), loads / len(timings)
+            self.busy[name] = self.busy.get(name, 0.0) + ended - started
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self.tasks.append(t)
+
+
 class Worker(object):
-    def __init__(self, ctx: BaseContext, name: str, tq: multiprocessing.Queue, rq: multiprocessing.Queue, init: Task, error_mode: Literal["str", "exception"]):
+    def __init__(
+        self,
+        ctx: BaseContext,
+        name: str,
+        init: Task,
+        error_mode: Literal["str", "exception"],
+        functions: "dict[int, bytes]" = None,
+        shared_memory_threshold: int = None,
+        max_tasks: int = None,
+        max_rss: int = None,
+        work_stealing: bool = False,
+        cache_size: int = _WORKER_CACHE_SIZE,
+        serializer: "Serializer" = None,
+        backend: Literal["process", "thread", "inline", "remote"] = "process",
+        telemetry: bool = False,
+    ):
         """
         Worker class responsible for executing tasks in parallel, created by TaskManager.
 
+        Every worker has its own task queue and result pipe, so that a worker that dies
+        cannot leave a queue shared with the other workers locked or half written.
+
         REQUIRED
         --------
         ctx: BaseContext
             Process spawning context ForkContext/SpawnContext. Note: Windows cannot fork.
         name: str
             Name of the worker process.
-        tq: Queue
-            Task queue
-        rq: Queue
-            Result queue
         init: Task
             Task executed when worker starts.
         error_mode: 'str' | 'exception'
             Which error mode to use, 'str' for legacy where exception is returned as string or 'exception' where exception is returned as pickled object.
+
+        OPTIONAL
+        --------
+        functions: dict
+            Functions registered before the worker was created: {function id: pickled function}.
+        shared_memory_threshold: int | None
+            Results with buffers of at least this many bytes are returned through shared memory.
+        max_tasks: int | None
+            Number of tasks after which the worker asks to be replaced.
+        max_rss: int | None
+            Resident memory in bytes above which the worker asks to be replaced.
+        work_stealing: bool
+            The parent may hand the messages the worker has not started to another worker.
+        cache_size: int
+            Size in bytes of the cache of the worker's context, see WorkerContext.
+        serializer: Serializer | None
+            Serializer of the functions, arguments (both as _Packed) and results, None for the queue's pickle.
+        backend: 'process' | 'thread' | 'inline' | 'remote'
+            What runs the worker, see backend of TaskManager. An inline worker has no queue: the TaskManager
+            calls setup and execute itself. A remote worker runs in a worker agent on another machine (see
+            mplite.worker), the TaskManager and the agent each connect their end of the socket to it.
+        telemetry: bool
+            Result messages carry the start and end times of their tasks, see TaskManager.stats
         """
         assert error_mode in (ERR_MODE_STR, ERR_MODE_EXCEPTION), f"Error mode must be in ('{ERR_MODE_STR}', '{ERR_MODE_EXCEPTION}'), got '{error_mode}'"
         self.ctx = ctx
+        self.name = name
         self.exit = ctx.Event()
-        self.tq = tq  # workers task queue
-        self.rq = rq  # workers result queue
+        self.backend = backend
+        if backend == "process":
+            self.tq = ctx.Queue()  # workers task queue, also used to register functions.
+            self.results, self.rq = ctx.Pipe(duplex=False)  # workers result pipe: (parent end, worker end)
+        elif backend == "thread":
+            self.tq = _LocalQueue()
+            self.results = self.rq = _LocalPipe()
+        else:  # set by TaskManager._join and by the agent for remote workers.
+            self.tq = self.results = self.rq = None
         self.init = init
+        self.functions = dict(functions or {})
+        self.shared_memory_threshold = shared_memory_threshold
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss
+        self.cache_size = cache_size
+        self.serializer = serializer
+        self.in_flight: "dict[int, Union[tuple, list]]" = {}  # messages sent to the worker, by first task id.
+        self.prefetch = _PREFETCH  # messages the parent lets the worker hold, see TaskManager._read
+        self.last_result = None  # time the parent received the last result.
+        self.message_duration = None  # moving average of the time between results, while the worker is busy.
+        # (id of the running task or 0, time.monotonic() when it started, number of cancel messages sent,
+        #  number of messages started)
+        self.status = ctx.RawArray("d", 4)
+        self.lock = ctx.Lock() if work_stealing else None  # held while the worker starts a message, see claim.
+        self.answered = 0  # messages the parent received results for, see TaskManager._steal
+        self.stolen = set()  # keys of in_flight messages handed to another worker, the worker skips them.
+        self.terminated = None  # id of the task the worker was terminated for (timeout or cancel).
+        self.backlog = deque()  # messages read ahead of a cancel message, see read_ahead.
+        self.cancelled = set()  # ids of tasks to skip.
+        self.handed_over = set()  # ids of skipped tasks that another worker runs, their shared memory stays.
+        self.cancels_seen = 0
+        self.timings = [] if telemetry else None  # (task id, started, ended) of the tasks since the last result message.
+        self.last_seen = time.monotonic()  # when the parent last heard from a remote worker, see TaskManager._heartbeats
+        self.created = time.perf_counter()  # for the idle time of a worker without results, see TaskManager._scale
+        self.ready = False  # the worker ran worker_init, and takes tasks, see TaskManager._ready
 
         self.err_mode = error_mode
-        self.process = ctx.Process(group=None, target=self.update, name=name, daemon=False)
+        if backend == "process":
+            self.process = ctx.Process(group=None, target=self.update, name=name, daemon=False)
+        elif backend == "thread":
+            self.process = _ThreadProcess(self.update, name, on_exit=self.results.writer.close)
+        else:
+            self.process = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["results"], state["in_flight"] = None, {}  # parent side only.
+        return state
 
     def start(self):
         self.process.start()
+        if self.backend == "process":
+            self.rq.close()  # only the process writes results, so the parent end reports EOF when it dies.
 
     def is_alive(self):
         return self.process.is_alive()
@@ -133,31 +1002,218 @@ class Worker(object):
     def exitcode(self):
         return self.process.exitcode
 
-    def update(self):
+    def close(self):
+        """ releases the parent's ends of the queue and pipe, after the process ended. """
+        self.tq.cancel_join_thread()  # messages for a dead process are never read.
+        self.tq.close()
+        self.results.close()
+        if self.backend == "remote":
+            self.process.close()
+
+    def setup(self):
+        """ runs worker_init and loads the registered functions, before the worker executes tasks. """
+        self.context = WorkerContext(self.name, self.cache_size)
+        self.context_arguments = weakref.WeakKeyDictionary()  # function -> position of its ctx parameter, see bind.
         if self.init:
-            self.init.f(*self.init.args, **self.init.kwargs)
+            self.context.state = self.init.f(*self.init.args, **self.bind(self.init.f, self.init.args, self.init.kwargs))
 
-        do_task = _do_task_exception_mode if self.err_mode == ERR_MODE_EXCEPTION else _do_task_str_mode
+        self.loads = pickle.loads if self.serializer is None else self.serializer.loads
+        self.functions = {fid: self.loads(f) for fid, f in self.functions.items()}
+        self.do_task = _do_task_for(self.err_mode)
+
+    def update(self):
+        started = time.monotonic()
+        self.setup()
+        # see TaskManager._ready, with telemetry with the pid and the times of worker_init.
+        self.rq.send("ready" if self.timings is None else ("ready", os.getpid(), started, time.monotonic()))
+        recycle = self.max_tasks is not None or self.max_rss is not None
+        done, rss_checked = 0, 0.0  # tasks executed, and when the memory use was checked.
 
         while True:
-            try:
-                task = self.tq.get_nowait()
-            except queue.Empty:
-                task = None
+            # blocks until a task is available, no need to poll.
+            message = self.backlog.popleft() if self.backlog else self.tq.get()
+            if type(message) is bytes:  # pickled by the parent, which measures the size, see TaskManager._send
+                message = pickle.loads(message)
+
+            if message == "stop":
+                self.exit.set()
+                break
 
-            if task == "stop":
-                self.tq.put_nowait(task)
+            elif self.control(message):
+                continue
+
+            elif isinstance(message, tuple):
+                self.claim()
+                self.send(self.execute(message))  # a single task, see TaskManager._encode
+                done += 1
+
+            elif isinstance(message, list):
+                # a chunk of tasks is answered with a single message: ([(task.id, result), ...], seconds spent)
+                self.claim()
+                start = time.perf_counter()
+                results = [self.execute(m) for m in message]
+                self.send((results, time.perf_counter() - start))
+                done += len(message)
+
+            if not recycle:
+                continue
+            worn_out = self.max_tasks is not None and done >= self.max_tasks
+            if not worn_out and self.max_rss is not None and time.monotonic() - rss_checked > _RSS_CHECK_INTERVAL:
+                rss_checked = time.monotonic()
+                worn_out = _rss() > self.max_rss
+            if worn_out:
+                # the parent starts a replacement and sends the tasks still in the queue to the other workers.
+                self.rq.send("retire")
+                while self.tq.get() != "stop":
+                    pass
                 self.exit.set()
                 break
 
-            elif isinstance(task, Task):
-                self.rq.put((task.id, do_task(task)))
+    def execute(self, message: tuple):
+        """
+        executes an encoded task (task.id, function id | function | TaskChain, args, kwargs), returns (task.id, result)
+        """
+        task_id, f, args, kwargs = message
+        if self.status[2] != self.cancels_seen:
+            self.read_ahead()
+        if self.cancelled and task_id in self.cancelled:
+            self.cancelled.discard(task_id)
+            if task_id in self.handed_over:
+                self.handed_over.discard(task_id)
             else:
-                time.sleep(0.01)
+                _release_shared(message)
+            return task_id, (False, None)  # answered all the same, the parent counts the messages a worker holds.
+        started = time.monotonic()
+        self.status[1] = started  # written before the id, so the parent never sees a new id with an old time.
+        self.status[0] = task_id
+        success = True
+        if type(f) is _Packed:
+            success, f = self.do_task(self.serializer.loads, (f.data,), {})
+        if not success:
+            result = f
+        elif type(f) is TaskChain:
+            success, result = self.resolve(f)
+        else:
+            if type(f) is int:
+                f = self.functions[f]  # registrations arrive before the tasks using them.
+            result = (args, kwargs)
+            if type(args) is _SharedPayload:
+                success, result = self.do_task(args.loads, (), {})
+            elif type(args) is _Packed:
+                success, result = self.do_task(self.serializer.loads, (args.data,), {})
+            if success:
+                args, kwargs = result
+                success, result = self.do_task(f, args, self.bind(f, args, kwargs))
+
+        if success and type(result) is not _SharedPayload:
+            if self.shared_memory_threshold is not None:
+                success, result = self.do_task(_SharedPayload.dumps, (result, self.shared_memory_threshold), {})
+            elif self.serializer is not None:
+                success, result = self.do_task(_Packed.dumps, (result, self.serializer), {})
+        self.status[0] = 0
+        if self.timings is not None:
+            self.timings.append((task_id, started, time.monotonic()))
+        return task_id, (success, result)
+
+    def send(self, message):
+        """ sends a result message, with the timings of its tasks when the TaskManager records them. """
+        if self.timings is not None:
+            message, self.timings = _Timed(message, self.timings), []
+        self.rq.send(message)
+
+    def control(self, message) -> bool:
+        """
+        handles ("register", function id, pickled function), ("unregister", function id), ("cancel", task ids)
+        and ("steal", task ids) messages, False for other messages.
+        """
+        if type(message) is not tuple or type(message[0]) is not str:
+            return False
+        if message[0] == "register":
+            self.functions[message[1]] = self.loads(message[2])
+        elif message[0] == "unregister":
+            self.functions.pop(message[1], None)
+        else:
+            self.cancelled.update(message[1])
+            if message[0] == "steal":
+                self.handed_over.update(message[1])
+            self.cancels_seen += 1
+        return True
+
+    def claim(self):
+        """ counts the message the worker starts, from then on the parent no longer hands it to another worker. """
+        if self.lock is None:
+            self.status[3] += 1
+            return
+        with self.lock:  # the parent holds it while it checks the count and sends a cancel message, see TaskManager._steal
+            if self.status[2] != self.cancels_seen:
+                self.read_ahead()
+            self.status[3] += 1
+
+    def bind(self, f: Callable, args: tuple, kwargs: dict) -> dict:
+        """ adds ctx=<the worker's context> to the keyword arguments of functions with a `ctx: WorkerContext` parameter, unless given. """
+        try:
+            position = self.context_arguments.get(f)
+            if position is None:
+                position = self.context_arguments[f] = _context_position(f)
+        except TypeError:  # callables without weak references.
+            position = _context_position(f)
+        if position < 0 or len(args) > position or "ctx" in kwargs:
+            return kwargs
+        return {**kwargs, "ctx": self.context}
+
+    def read_ahead(self):
+        """ reads the task queue up to the last cancel message the parent sent, keeping the tasks for later. """
+        while self.cancels_seen < self.status[2]:
+            message = self.tq.get()
+            if not self.control(message):
+                self.backlog.append(message)
+
+    def resolve(self, chain: TaskChain):
+        """ runs a TaskChain to completion, with the same semantics as TaskManager.execute, returns the final result """
+        t = chain
+        while True:
+            task = t.task if isinstance(t, TaskChain) else t
+            success, result = self.do_task(task.f, task.args, self.bind(task.f, task.args, task.kwargs))
+            if not success and self.err_mode == ERR_MODE_EXCEPTION:
+                return success, result
+            if not isinstance(t, TaskChain) or t.next is None:
+                return success, result
+            success, t = self.do_task(t.resolve, (result,), {})
+            if not success:  # next_task failed.
+                return success, t
 
 
 class TaskManager(object):
-    def __init__(self, cpu_count: int = None, context=default_context, worker_init: Task = None, error_mode: Literal["str", "exception"] = ERR_MODE_STR) -> None:
+    def __init__(
+        self,
+        cpu_count: int = None,
+        context=default_context,
+        worker_init: Task = None,
+        error_mode: Literal["str", "exception"] = ERR_MODE_STR,
+        chunksize: Union[int, Literal["auto"]] = 1,
+        function_registry: bool = False,
+        shared_memory_threshold: int = None,
+        max_retries: int = 0,
+        task_timeout: float = None,
+        max_tasks_per_worker: int = None,
+        max_worker_rss: int = None,
+        interrupt_running: bool = False,
+        priority_aging: float = 1.0,
+        work_stealing: bool = False,
+        worker_cache_size: int = _WORKER_CACHE_SIZE,
+        result_cache: Union[ResultCache, bool] = None,
+        serializer: Serializer = None,
+        backend: Literal["process", "thread", "inline"] = "process",
+        listen: Tuple[str, int] = None,
+        authkey: Union[bytes, str] = None,
+        heartbeat_timeout: float = 10.0,
+        min_workers: int = None,
+        max_workers: int = None,
+        idle_timeout: float = 60.0,
+        preload: "list[str]" = None,
+        telemetry: Union[Stats, bool] = False,
+        trace: str = None,
+    ) -> None:
         """
         Class responsible for managing worker processes and tasks.
 
@@ -168,27 +1224,267 @@ class TaskManager(object):
             Default: {cpu core count}.
         ctx: BaseContext
             Process spawning context ForkContext/SpawnContext. Note: Windows cannot fork.
+            "forkserver" starts the workers fastest where it is available (Unix): they are forked from a server
+            process that imported mplite and the modules in preload once.
             Default: "spawn"
         worker_init: Task | None
-            Task executed when worker starts.
+            Task executed when worker starts. Its return value is kept by the worker, and passed to the tasks
+            whose function has a `ctx: WorkerContext` parameter as ctx.state, see WorkerContext.
             Default: None
         error_mode: 'str' | 'exception'
             Which error mode to use, 'str' for legacy where exception is returned as string or 'exception' where exception is returned as pickled object.
             Default: 'str'
+        chunksize: int | 'auto'
+            Number of tasks sent to a worker in one message, the results are returned in one message as well.
+            Larger chunks reduce the per task IPC overhead for many small tasks.
+            'auto' measures how long the first tasks take and picks a chunksize from that (execute only, submit uses 1).
+            Default: 1
+        function_registry: bool
+            False: (default) the function is pickled with every task.
+            True: each function is sent to every worker once, when the pool starts or when it is first used.
+                Tasks then only carry a small function id with their arguments, which makes them much cheaper
+                to send for partials and callable objects that carry large state. The function is pickled once:
+                later changes to the state of a callable object or bound method don't reach the workers.
+                The last 256 functions used stay registered, older ones are dropped from the workers once no
+                open task uses them. Create such callables once and reuse them, as a new callable per task
+                would be sent to every worker.
+        shared_memory_threshold: int | None
+            None: (default) arguments and results are pickled through the queues.
+            int: arguments and results holding buffers (bytes, bytearray, numpy arrays, ...) of at least
+                this many bytes send these buffers through a shared memory segment (pickle protocol 5,
+                out-of-band), instead of copying them through the queue's pipe. The receiver unlinks the
+                segment on arrival; numpy arrays keep using the shared memory without a copy until they
+                are garbage collected. Not available on Windows, where it is ignored.
+        max_retries: int
+            Workers that die (e.g. killed by the OOM killer) are replaced by a new worker, and the tasks they
+            held but had not started are sent to other workers. The task that was running is sent again
+            up to max_retries times, after that it fails with ChildProcessError.
+            Default: 0
+        task_timeout: float | None
+            None: (default) tasks may run as long as they take.
+            float: seconds a task may run, after which its worker is terminated and replaced, and the task
+                fails with TimeoutError (reported like an exception raised by the task, see error_mode).
+                Task.with_timeout sets the timeout of a single task.
+        max_tasks_per_worker: int | None
+            None: (default) workers run for as long as the TaskManager.
+            int: a worker that ran this many tasks (a chunk is not interrupted) exits and is replaced by a
+                new worker, which runs worker_init again. Bounds the memory leaked by worker functions.
+        max_worker_rss: int | None
+            None: (default) no limit.
+            int: a worker whose resident memory exceeds this many bytes after a task exits and is replaced,
+                as with max_tasks_per_worker. Measured through /proc on Linux, elsewhere psutil is used
+                when installed, or else the peak memory use of the worker.
+        interrupt_running: bool
+            What happens to running tasks when they are cancelled, by cancel or by an execute, imap or
+            execute_graph call that raises (e.g. on the first failed task in 'exception' error mode).
+            Tasks that have not started are always dropped.
+            False: (default) they run to completion, their results are discarded.
+            True: their worker is terminated and replaced.
+        priority_aging: float
+            Priority (see Task.with_priority) a task gains per second while it waits for a worker, so that
+            a task waits at most (difference in priority / priority_aging) seconds for tasks of higher priority
+            that were submitted after it. 0 gives strict priorities, under which low priority tasks may starve.
+            Tasks already sent to a worker are not overtaken: each worker holds about 5 ms of work, at least
+            its running task and the next one.
+            Default: 1.0
+        work_stealing: bool
+            Each worker has its own queue, and tasks go to the workers with the fewest tasks waiting.
+            False: (default) a task waits for the worker it was sent to.
+            True: once no tasks are waiting, an idle worker takes over a task (or chunk) that a busy worker
+                holds but has not started, e.g. the task queued behind a long running one. Shortens the total
+                time of tasks of very different durations, at the cost of a lock per message in the workers.
+        worker_cache_size: int
+            Size in bytes of each worker's ctx.cache (see WorkerContext), an LRUCache that tasks can use
+            to keep expensive per-worker lookups.
+            Default: 256 MiB
+        result_cache: ResultCache | bool | None
+            None: (default) every task runs.
+            ResultCache | True (a ResultCache in memory): the results of Tasks are cached by a hash of their
+                function's qualified name and pickled arguments. execute, imap and submit return cached results
+                without sending the task to a worker, and a task identical to one that is running waits for its
+                result instead of running again. Failed tasks are not cached. Not for TaskChains.
+        serializer: Serializer | None
+            None: (default) functions, arguments and results are pickled by the queues and pipes.
+            Serializer: serializes them instead, to pick the pickle protocol, serialize lambdas and local functions
+                with cloudpickle, or compress large payloads, see Serializer. Arguments and results that go through
+                shared memory (see shared_memory_threshold) are not compressed.
+        backend: 'process' | 'thread' | 'inline'
+            What runs the tasks, with the same API and results.
+            'process': (default) worker processes, for CPU bound Python code.
+            'thread': worker threads in this process, for I/O bound tasks and tasks that release the GIL (NumPy,
+                hashing, compression). Tasks and results are passed without pickling, and functions need not be
+                picklable. Threads cannot be stopped from outside: task_timeout, max_worker_rss and
+                interrupt_running are not available, and timeouts set with Task.with_timeout are ignored.
+            'inline': no workers, each task runs in the calling thread as it is dispatched (by execute, imap,
+                submit, ...), which makes it easy to debug and profile. Same restrictions as 'thread'.
+        listen: (host, port) | None
+            None: (default) only the cpu_count local workers run tasks.
+            (host, port): worker agents on other machines, started with `python -m mplite.worker --connect host:port`,
+                join the pool over TCP for as long as the TaskManager runs, and take tasks like the local workers.
+                Port 0 picks a free port, see address. cpu_count may be 0, tasks then wait for the first agent.
+                Remote workers need the functions of the tasks to be importable on their machine, are not replaced
+                by max_tasks_per_worker or max_worker_rss, and don't enforce timeouts or interrupt_running.
+                Requires the 'process' backend, and no shared_memory_threshold or keep_in_worker.
+        authkey: bytes | str | None
+            Secret that the worker agents must know to join, checked by an HMAC challenge in both directions.
+            The connection is not encrypted: use a trusted network or a tunnel.
+            Default: the environment variable MPLITE_AUTHKEY, required with listen.
+        heartbeat_timeout: float
+            Seconds without a message (agents send a heartbeat every heartbeat_timeout / 4 seconds) after which
+            a remote worker counts as lost, like a local worker that died: the tasks it held go to other workers,
+            the one it was running is retried up to max_retries times. A closed connection counts as lost at once.
+            Also the seconds an agent has to authenticate after it connects, before it is disconnected.
+            Default: 10.0
+        min_workers, max_workers: int | None
+            None: (default) the pool has cpu_count workers from start to stop.
+            int: the pool starts with min_workers workers (default: cpu_count), and grows up to max_workers while
+                tasks wait for a worker for more than 0.1 second, doubling at most per step. New workers run
+                worker_init before they take tasks, the tasks meanwhile go to the running workers.
+                Remote workers don't count, see listen. Not for the 'inline' backend.
+        idle_timeout: float
+            Seconds after which a worker that has nothing to do is stopped, while the pool has more than
+            min_workers workers. Only with max_workers.
+            Default: 60.0
+        preload: list[str] | None
+            Modules that the fork server imports before it forks the workers, e.g. ["numpy", "pandas"], so that
+            the workers don't import them again. Requires context="forkserver". The fork server is shared by all
+            TaskManagers of the process: the preload of the first TaskManager to start applies.
+        telemetry: Stats | bool
+            False: (default) nothing is recorded.
+            Stats | True (a Stats of the last 100,000 tasks): records when each task was queued, sent to a worker,
+                started, ended and received, the sizes of the pickled tasks and results, and how busy each worker
+                was, see stats. The parent pickles the tasks itself to measure them (instead of the queue's feeder
+                thread), otherwise the overhead is a few microseconds per message.
+        trace: str | None
+            Path of a Chrome trace event file that stop writes, see Stats.write_trace. Open it in
+            https://ui.perfetto.dev to see the tasks of each worker process on a timeline, with the worker_init,
+            the idle gaps and the steps of TaskChains, and how many tasks wait for a worker. Records telemetry.
+            Default: None
         """
 
         assert error_mode in (ERR_MODE_STR, ERR_MODE_EXCEPTION), f"Error mode must be in ('{ERR_MODE_STR}', '{ERR_MODE_EXCEPTION}'), got '{error_mode}'"
         assert worker_init is None or isinstance(worker_init, Task), "Init is not (None, type[Task])"
+        _check_chunksize(chunksize)
+        if shared_memory_threshold is not None:
+            if not isinstance(shared_memory_threshold, int) or shared_memory_threshold < 1:
+                raise ValueError(f"shared_memory_threshold must be a positive integer or None, got {shared_memory_threshold!r}")
+            if os.name == "nt":  # a segment is destroyed when its creator closes it, before the receiver can open it.
+                warnings.warn("shared_memory_threshold is not supported on Windows and is ignored.")
+                shared_memory_threshold = None
+        if not isinstance(max_retries, int) or max_retries < 0:
+            raise ValueError(f"max_retries must be a non-negative integer, got {max_retries!r}")
+        if task_timeout is not None and not task_timeout > 0:
+            raise ValueError(f"task_timeout must be positive or None, got {task_timeout!r}")
+        for name, limit in (("max_tasks_per_worker", max_tasks_per_worker), ("max_worker_rss", max_worker_rss)):
+            if limit is not None and (not isinstance(limit, int) or limit < 1):
+                raise ValueError(f"{name} must be a positive integer or None, got {limit!r}")
+        if not isinstance(worker_cache_size, int) or worker_cache_size < 0:
+            raise ValueError(f"worker_cache_size must be 0 or a positive integer, got {worker_cache_size!r}")
+        if not priority_aging >= 0:
+            raise ValueError(f"priority_aging must be 0 or positive, got {priority_aging!r}")
+        if backend not in ("process", "thread", "inline"):
+            raise ValueError(f"backend must be 'process', 'thread' or 'inline', got {backend!r}")
+        if backend != "process":
+            for name, value in (("task_timeout", task_timeout), ("max_worker_rss", max_worker_rss), ("interrupt_running", interrupt_running)):
+                if value:
+                    raise ValueError(f"{name} requires the 'process' backend, threads cannot be stopped from outside.")
+        if listen is not None:
+            if backend != "process":
+                raise ValueError(f"listen requires the 'process' backend, got {backend!r}")
+            if shared_memory_threshold is not None:
+                raise ValueError("listen can't be combined with shared_memory_threshold, remote workers don't share the memory.")
+            authkey = authkey or os.environ.get("MPLITE_AUTHKEY")
+            if not authkey:
+                raise ValueError("listen requires an authkey, or the environment variable MPLITE_AUTHKEY.")
+        if preload is not None and multiprocessing.get_context(context).get_start_method() != "forkserver":
+            raise ValueError(f"preload requires the 'forkserver' context, got {context!r}")
+        if max_workers is not None:
+            if backend == "inline":
+                raise ValueError("max_workers requires the 'process' or 'thread' backend.")
+            if min_workers is None:
+                min_workers = multiprocessing.cpu_count() if cpu_count is None else cpu_count
+            if not isinstance(min_workers, int) or not isinstance(max_workers, int) or not 0 <= min_workers <= max_workers or max_workers < 1:
+                raise ValueError(f"min_workers and max_workers must be integers with 0 <= min_workers <= max_workers and max_workers > 0, got {min_workers!r} and {max_workers!r}")
+            if not idle_timeout > 0:
+                raise ValueError(f"idle_timeout must be positive, got {idle_timeout!r}")
+        elif min_workers is not None:
+            raise ValueError("min_workers requires max_workers.")
+        if not heartbeat_timeout > 0:
+            raise ValueError(f"heartbeat_timeout must be positive, got {heartbeat_timeout!r}")
+        if max_worker_rss is not None and _rss() is None:
+            raise ImportError("max_worker_rss requires psutil on this platform.")
 
         self._ctx = multiprocessing.get_context(context)
         self._cpus = multiprocessing.cpu_count() if cpu_count is None else cpu_count
-        self.tq = self._ctx.Queue()
-        self.rq = self._ctx.Queue()
+        if max_workers is not None:
+            self._cpus = min_workers
+        self.backend = backend
+        self._inline: Worker = None  # runs the tasks of the inline backend.
         self.pool: list[Worker] = []
-        self._open_tasks: list[int] = []
+        self._retiring: list[Worker] = []  # workers replaced by max_tasks_per_worker or max_worker_rss, or idle, until they exit.
+        self._pending = _Pending(priority_aging)  # messages waiting for a worker with room for them.
+        self._priorities: dict[int, float] = {}  # task id -> priority, for encoded tasks with a priority.
+        self._affinities: dict[int, Hashable] = {}  # task id -> affinity key, for encoded tasks with a key.
+        self._dispatch_lock = threading.Lock()  # guards _pending, the pool and the workers in_flight messages.
+        self._workers_ready = threading.Condition(self._dispatch_lock)  # notified when a worker joins the pool.
+        self._attempts: dict[int, int] = {}  # task id -> times it was lost with a worker.
+        self._timeouts: dict[int, float] = {}  # task id -> timeout, for the open tasks that have one.
+        self._cancelled: set[int] = set()  # cancelled tasks held by workers, not to be sent again if a worker dies.
+        self._deaths = 0  # workers that died since the last result, to give up on workers that cannot start.
+        self._stopping = False
+        self._open_tasks: set[int] = set()
+        self._submitted: list[Task] = []  # tasks from submit waiting for a full chunk.
+        self._submitted_since = 0.0  # time.monotonic() when the first of them was submitted, see _linger.
+        self._submit_lock = threading.RLock()  # submit may be called from several threads.
+
+        # results are read from rq by a collector thread and routed by task id to whoever is waiting for them:
+        # a Future (submit) or a queue.SimpleQueue of an execute/imap call. Results without a route are dropped.
+        self._routes: dict[int, Union[Future, queue.SimpleQueue]] = {}
+        self._unclaimed: "OrderedDict[int, Future]" = OrderedDict()  # finished futures that take may return.
+        self._completed = threading.Condition()  # guards _unclaimed.
+        self._collector: threading.Thread = None
+        self._wakeup = None  # connection to wake up the collector.
+        self._server: socket.socket = None  # accepts the worker agents, see listen.
+        self._acceptor: threading.Thread = None
+        self._scaler: threading.Thread = None
+        self._scaler_stop = threading.Event()
+        self._broken: ChildProcessError = None
 
         self.error_mode = error_mode
         self.worker_init = worker_init
+        self.chunksize = chunksize
+
+        self.function_registry = function_registry
+        self.shared_memory_threshold = shared_memory_threshold
+        self.max_retries = max_retries
+        self.task_timeout = task_timeout
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_worker_rss = max_worker_rss
+        self.interrupt_running = interrupt_running
+        self.priority_aging = priority_aging
+        self.work_stealing = work_stealing
+        self.worker_cache_size = worker_cache_size
+        self.result_cache = ResultCache() if result_cache is True else (result_cache or None)
+        self.serializer = serializer
+        self.listen = listen
+        self._authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        self.heartbeat_timeout = heartbeat_timeout
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.idle_timeout = idle_timeout
+        self.preload = list(preload or [])
+        self.trace = trace
+        self._stats: Stats = Stats() if telemetry is True or (trace is not None and not telemetry) else (telemetry or None)
+        self._memo_keys: dict[int, bytes] = {}  # task id -> cache key, for the tasks that run for the result_cache.
+        self._memo_leaders: dict[bytes, int] = {}  # cache key -> id of the task that runs for it.
+        self._memo_followers: dict[int, list[Task]] = {}  # task id -> identical tasks that wait for its result.
+        self._memo_lock = threading.Lock()
+        self._functions: OrderedDict[Callable, int] = OrderedDict()  # function -> function id, least recently used first.
+        self._pickled_functions: dict[int, bytes] = {}  # function id -> pickled function, for new workers.
+        self._function_ids = count()
+        self._function_uses: dict[int, int] = {}  # function id -> open tasks using it, which keep it registered.
+        self._task_functions: dict[int, int] = {}  # task id -> function id, while the task is open.
+        self._register_lock = threading.Lock()
 
     def __enter__(self):
         self.start()
@@ -197,15 +1493,201 @@ class TaskManager(object):
     def __exit__(self, exc_type, exc_val, exc_tb):  # signature requires these, though I don't use them.
         self.stop()  # stop the workers.
 
+    async def __aenter__(self):
+        import asyncio
+
+        await asyncio.get_running_loop().run_in_executor(None, self.start)  # don't block the loop while spawning.
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        import asyncio
+
+        await asyncio.get_running_loop().run_in_executor(None, self.stop)
+
     def start(self):
-        for i in range(self._cpus):  # create workers
-            worker = Worker(self._ctx, name=str(i), tq=self.tq, rq=self.rq, init=self.worker_init, error_mode=self.error_mode)
-            self.pool.append(worker)
-            worker.start()
-        while not all(p.is_alive() for p in self.pool):
-            time.sleep(0.01)
+        self._stopping = False
+        self._deaths = 0
+        self._broken = None
+        if self.backend == "inline":
+            self._inline = self._worker("inline")
+            started = time.monotonic()
+            self._inline.setup()
+            if self._stats is not None:
+                self._stats._started(self._inline.name, os.getpid(), started, time.monotonic())
+            return
+        if self.backend == "process" and self._ctx.get_start_method() == "forkserver":
+            # the workers are forked with these imported. the __main__ module is what multiprocessing preloads by default.
+            self._ctx.set_forkserver_preload(["__main__", "mplite", *self.preload])
+
+        wakeup_reader, self._wakeup = connection.Pipe(duplex=False)
+        self._collector = threading.Thread(target=self._collect, args=(wakeup_reader,), name="mplite-collector", daemon=True)
+        self._collector.start()
+
+        self._spawn(*[str(i) for i in range(self._cpus)])
+        with self._workers_ready:  # the workers ran worker_init, the first tasks don't wait for it.
+            self._workers_ready.wait_for(lambda: self._broken is not None or all(w.ready or w.backend == "remote" for w in self.pool))
+
+        if self.max_workers is not None:
+            self._scaler_stop.clear()
+            self._scaler = threading.Thread(target=self._scale, name="mplite-scaler", daemon=True)
+            self._scaler.start()
+
+        if self.listen is not None:
+            self._server = socket.create_server(self.listen)
+            self._acceptor = threading.Thread(target=self._accept, args=(self._server,), name="mplite-acceptor", daemon=True)
+            self._acceptor.start()
+
+    @property
+    def stats(self) -> Union[Stats, None]:
+        """ the telemetry of the tasks and workers (see telemetry), None without telemetry. """
+        return self._stats
 
-    def execute(self, tasks: "list[Union[Task, TaskChain]]", tqdm=_tqdm, pbar: _tqdm = None):
+    @property
+    def address(self) -> Union[Tuple[str, int], None]:
+        """ the (host, port) the worker agents connect to while the TaskManager runs, see listen. """
+        return None if self._server is None else self._server.getsockname()[:2]
+
+    def _workers(self) -> int:
+        """ the number of workers to keep busy, at least 1: cpu_count may be 0, see listen and min_workers. """
+        return max(self._cpus, len(self.pool), 1)
+
+    def _worker(self, name: str, remote: bool = False) -> Worker:
+        return Worker(
+            self._ctx,
+            name=name,
+            init=self.worker_init,
+            error_mode=self.error_mode,
+            functions=self._pickled_functions,
+            shared_memory_threshold=self.shared_memory_threshold,
+            max_tasks=None if remote else self.max_tasks_per_worker,  # a remote worker can't be replaced.
+            max_rss=None if remote else self.max_worker_rss,
+            work_stealing=self.work_stealing and not remote,  # the parent can't see which messages it started.
+            cache_size=self.worker_cache_size,
+            serializer=self.serializer,
+            backend="remote" if remote else self.backend,
+            telemetry=self._stats is not None,
+        )
+
+    def _spawn(self, *names: str) -> "list[Worker]":
+        """
+        creates and starts workers, which receive all functions registered so far.
+        they take tasks once they ran worker_init, see _ready.
+        """
+        with self._register_lock:  # no function can be registered between the copy and joining the pool.
+            workers = [self._worker(name) for name in names]
+            if len(workers) > 1:  # launched at once: starting a process waits for the OS, which starts the others meanwhile.
+                with futures.ThreadPoolExecutor(len(workers)) as launcher:
+                    list(launcher.map(Worker.start, workers))
+            elif workers:
+                workers[0].start()
+            with self._dispatch_lock:
+                self.pool.extend(workers)
+        self._wakeup.send("pool")  # the collector watches the workers from now on.
+        return workers
+
+    def _ready(self, worker: Worker, pid: int = None, init_started: float = None, init_ended: float = None):
+        """ called by the collector: a worker ran worker_init, and takes tasks from now on. """
+        with self._dispatch_lock:
+            worker.ready = True
+            if self._stats is not None:
+                self._stats._started(worker.name, pid, init_started, init_ended)
+            self._assign()
+            self._workers_ready.notify_all()
+
+    def _scale(self):
+        """
+        runs in a background thread with max_workers: adds workers while tasks wait for one, and stops
+        the workers that were idle for idle_timeout seconds, down to min_workers.
+        """
+        while not self._scaler_stop.wait(_SCALE_INTERVAL):
+            now = time.perf_counter()
+            with self._dispatch_lock:
+                if self._stopping:
+                    return
+                local = [w for w in self.pool if w.backend != "remote"]
+                size = len(local)
+                grow = 0
+                if self._pending and all(w.ready for w in local) and time.monotonic() - self._pending.since > _SCALE_UP_WAIT:
+                    grow = min(self.max_workers - size, len(self._pending), max(size, 1))  # at most doubles.
+                elif not self._pending:
+                    for worker in local:
+                        if size <= self.min_workers:
+                            break
+                        idle = now - (worker.created if worker.last_result is None else worker.last_result)
+                        if worker.ready and not worker.in_flight and idle > self.idle_timeout:
+                            if self._stats is not None:
+                                self._stats._stopped(worker.name)
+                            self.pool.remove(worker)
+                            self._retiring.append(worker)  # the collector reaps it, see _lost.
+                            worker.tq.put("stop")
+                            size -= 1
+                names = {w.name for w in self.pool}
+            if grow > 0:
+                self._spawn(*islice((str(i) for i in count() if str(i) not in names), grow))
+
+    def _accept(self, server: socket.socket):
+        """ runs in a background thread while listening: accepts the connections of worker agents, see mplite.worker """
+        while True:
+            try:
+                sock, address = server.accept()
+            except OSError:  # closed by stop.
+                return
+            if self._stopping:
+                sock.close()
+                return
+            # the handshake waits for the agent, which must not hold up the others.
+            threading.Thread(target=self._join, args=(sock, address), daemon=True).start()
+
+    def _join(self, sock: socket.socket, address: tuple):
+        """ authenticates a worker agent, sends it the settings of its worker, and adds the worker to the pool. """
+        name = f"{address[0]}:{address[1]}"
+        conn = connection.Connection(sock.dup().detach())  # sock is kept to shut the connection down, see _RemoteProcess.kill
+        process = _RemoteProcess(conn, sock)
+        # a client that doesn't complete the handshake in time is disconnected, its reads then fail with EOFError.
+        deadline = threading.Timer(self.heartbeat_timeout, process.kill)
+        deadline.daemon = True
+        deadline.start()
+        try:  # the same handshake as multiprocessing.connection.Listener, with the agent's connection.Client
+            connection.deliver_challenge(conn, self._authkey)
+            connection.answer_challenge(conn, self._authkey)
+        except (connection.AuthenticationError, EOFError, OSError) as e:
+            deadline.cancel()
+            warnings.warn(f"Rejected worker agent {name}: {e!r}")
+            conn.close()
+            sock.close()
+            return
+
+        with self._register_lock:  # see _spawn
+            worker = self._worker(name, remote=True)
+            settings = dict(
+                name=name,
+                init=worker.init,
+                error_mode=worker.err_mode,
+                functions=worker.functions,
+                cache_size=worker.cache_size,
+                serializer=worker.serializer,
+                telemetry=worker.timings is not None,
+                heartbeat=self.heartbeat_timeout / _HEARTBEATS,
+            )
+            try:
+                conn.send(settings)
+            except OSError:
+                conn.close()
+                sock.close()
+                return
+            finally:
+                deadline.cancel()
+            worker.tq, worker.results, worker.process = _RemoteQueue(conn), conn, process
+            worker.last_seen = time.monotonic()
+            with self._dispatch_lock:
+                if self._stopping:
+                    worker.tq.put("stop")
+                    worker.close()
+                    return
+                self.pool.append(worker)  # takes tasks once it ran worker_init, see _ready.
+        self._wakeup.send("pool")  # the collector watches the worker's connection from now on.
+
+    def execute(self, tasks: "list[Union[Task, TaskChain]]", tqdm=None, pbar: "tqdm" = None, chunksize: Union[int, Literal["auto"]] = None):
         """
         Execute tasks using mplite
 
@@ -216,8 +1698,8 @@ class TaskManager(object):
 
         OPTIONAL
         --------
-        tqdm: Type[tqdm]
-            Type[_tqdm]: (default) Use the standard tqdm module provided class.
+        tqdm: Type[tqdm] | None
+            None: (default) Use the standard tqdm module provided class, imported on first use.
             Type[tqdm]: A tqdm compatible callable.
 
             When progress bar is created, the given tqdm compatible callable will be used,
@@ -229,90 +1711,1636 @@ class TaskManager(object):
 
             Tracks the execution progress using tqdm instance,
             if None is provided, progress bar will be created using tqdm callable provided by tqdm parameter.
+
+        chunksize: int | 'auto'
+            None: (default) Use the chunksize of the TaskManager.
+            int: Number of tasks sent to a worker in one message.
+            'auto': Send one task to each worker first, then chunk the rest based on how long they took.
+
+            Results are always returned in the order of the tasks.
         """
+        chunksize = self.chunksize if chunksize is None else chunksize
+        _check_chunksize(chunksize)
+        self._flush_submitted()
+
         task_count = len(tasks)
-        tasks_running = [t.id for t in tasks]
-        self._open_tasks.extend(tasks_running)
+        tasks_running = set(t.id for t in tasks)
+        self._open_tasks.update(tasks_running)
         task_indices: dict[int, Tuple[int, Union[Task, TaskChain]]] = {}
 
         for i, t in enumerate(tasks):
-            self.tq.put(t if isinstance(t, Task) else t.task)
             task_indices[t.id] = (i, t)
         results = [None] * task_count
 
+        sink = queue.SimpleQueue()
+        self._routes.update(dict.fromkeys(tasks_running, sink))
+        try:
+            return self._execute(tasks, task_indices, tasks_running, results, sink, chunksize, tqdm, pbar)
+        finally:
+            if tasks_running:  # fail fast: the workers don't spend time on results nobody waits for.
+                self._cancel(tasks_running, self.interrupt_running)
+            for task_id in task_indices:
+                self._routes.pop(task_id, None)
+            self._open_tasks.difference_update(tasks_running)
+
+    def _execute(self, tasks, task_indices, tasks_running, results, sink, chunksize, tqdm, pbar):
+        task_count = len(tasks)
+        if chunksize == CHUNKSIZE_AUTO:
+            # every worker gets a single task as a one task chunk, so that it reports how long it took.
+            # the remaining tasks are held back until the first report is in.
+            workers = self._workers()
+            backlog = tasks[workers:]
+            sent = self._put_chunks(tasks[:workers], 1, as_chunk=True)
+            while backlog and not sent:  # all answered by the result_cache, so nothing will report how long it took.
+                backlog, sent = backlog[workers:], self._put_chunks(backlog[:workers], 1, as_chunk=True)
+        else:
+            backlog = []
+            self._put_chunks(tasks, chunksize)
+
         if pbar is None:
             """ if pbar object was not passed, create a new tqdm compatible object """
-            pbar = tqdm(total=task_count, unit='tasks')
+            pbar = (tqdm or _tqdm())(total=task_count, unit='tasks')
 
         while len(tasks_running) > 0:
-            try:
-                task_key, (success, res) = self.rq.get_nowait()
+            received, elapsed = self._receive(sink)
+
+            if backlog and elapsed is not None:
+                self._put_chunks(backlog, self._auto_chunksize(elapsed / len(received), len(backlog)))
+                backlog = []
 
+            for task_key, (success, res) in received:
                 if not success and self.error_mode == ERR_MODE_EXCEPTION:
-                    [self._open_tasks.remove(idx) for idx in tasks_running]
                     raise unpickle_exception(res)
 
                 idx, t = task_indices[task_key]
-                if isinstance(t, Task) or t.next is None:
-                    self._open_tasks.remove(t.id)
-                    tasks_running.remove(t.id)
+                if not _resolved_by_parent(t):
+                    self._open_tasks.discard(t.id)
+                    tasks_running.discard(t.id)
                     results[idx] = res
                     pbar.update(1)
                 else:
                     t = t.resolve(res)
                     task_indices[task_key] = (idx, t)
-                    self.tq.put(t if isinstance(t, Task) else t.task)
-            except queue.Empty:
-                dead_processes = list(filter(lambda p: not p.is_alive() and p.exitcode != 0, self.pool))
-                if len(dead_processes) > 0:
-                    return_codes = [p.exitcode for p in dead_processes]
-                    return_codes_str = ", ".join(str(p) for p in return_codes)
-
-                    if -9 in return_codes:
-                        raise ChildProcessError(f"One or more of processes were killed, likely because system ran out of memory. Exit codes: {return_codes_str}")
-                    raise ChildProcessError(f"One or more processes exited abruptly. Exit codes: {return_codes_str}")
-
-                time.sleep(0.01)
+                    self._put_chunks([t], 1)
         return results
 
-    def submit(self, task: Task):
-        """ permits asynchronous submission of tasks. """
-        if not isinstance(task, Task):
-            raise TypeError(f"expected mplite.Task, not {type(task)}")
-        self._open_tasks.append(task.id)
-        self.tq.put(task)
+    def execute_graph(self, graph: TaskGraph, tqdm=None, pbar: "tqdm" = None) -> list:
+        """
+        Execute a TaskGraph, sending each task to the workers as soon as its dependencies are done.
+
+        REQUIRED
+        --------
+        graph: TaskGraph
+            Graph of tasks to execute.
+
+        OPTIONAL
+        --------
+        tqdm, pbar: see execute.
+
+        returns the results in the order the tasks were added to the graph.
+        In 'str' error mode, the error of a failed task is passed to the tasks depending on it (as with TaskChain).
+        """
+        if self.listen is not None and any(graph.keep.values()):
+            raise ValueError("keep_in_worker requires workers on one machine, it can't be used with listen.")
+        self._flush_submitted()
+        tasks = graph.tasks
+        index = {t.id: i for i, t in enumerate(tasks)}
+        dependents: dict[int, list[int]] = {t.id: [] for t in tasks}
+        for t in tasks:
+            for d in graph.dependencies[t.id]:
+                dependents[d].append(t.id)
+
+        priority = {}  # length of the longest path from a task to the end of the graph.
+        for t in reversed(tasks):  # dependents are always added after their dependencies.
+            priority[t.id] = graph.costs[t.id] + max((priority[d] for d in dependents[t.id]), default=0)
+
+        waiting_for = {t.id: len(graph.dependencies[t.id]) for t in tasks}
+        consumers_left = {t.id: len(dependents[t.id]) for t in tasks}
+        ready = [(-priority[t.id], index[t.id]) for t in tasks if waiting_for[t.id] == 0]
+        heapq.heapify(ready)
+
+        values: dict[int, Any] = {}  # results that dependents still need.
+        results = [None] * len(tasks)
+        in_flight = set()
+        sink = queue.SimpleQueue()
+
+        if pbar is None:
+            pbar = (tqdm or _tqdm())(total=len(tasks), unit='tasks')
+
+        try:
+            while ready or in_flight:
+                # more would only queue up in the fifo task queue, ignoring priorities. follows the pool as it grows.
+                while ready and len(in_flight) < 2 * self._workers():
+                    _, i = heapq.heappop(ready)
+                    t = tasks[i]
+                    in_flight.add(t.id)
+                    self._open_tasks.add(t.id)
+                    self._routes[t.id] = sink
+                    self._put_chunks([graph._prepare(t, values)], 1)
+
+                received, _ = self._receive(sink)
+                for task_id, (success, res) in received:
+                    in_flight.discard(task_id)
+                    self._open_tasks.discard(task_id)
+                    self._routes.pop(task_id, None)
+
+                    if not success and self.error_mode == ERR_MODE_EXCEPTION:
+                        raise unpickle_exception(res)
+
+                    if type(res) is _SharedPayload:  # kept in shared memory by the worker.
+                        if consumers_left[task_id] > 0:
+                            values[task_id] = res
+                        else:
+                            res.unlink()
+                    else:
+                        results[index[task_id]] = res
+                        if consumers_left[task_id] > 0:
+                            values[task_id] = res
+                    pbar.update(1)
+
+                    for d in dependents[task_id]:
+                        waiting_for[d] -= 1
+                        if waiting_for[d] == 0:
+                            heapq.heappush(ready, (-priority[d], index[d]))
+                    for d in graph.dependencies[task_id]:
+                        consumers_left[d] -= 1
+                        if consumers_left[d] == 0:
+                            value = values.pop(d)
+                            if type(value) is _SharedPayload:
+                                value.unlink()
+            return results
+        finally:
+            if in_flight:
+                self._cancel(in_flight, self.interrupt_running)
+            for task_id in in_flight:
+                self._routes.pop(task_id, None)
+                self._open_tasks.discard(task_id)
+            for value in values.values():
+                if type(value) is _SharedPayload:
+                    value.unlink()
+
+    def imap(
+        self,
+        tasks: "Iterable[Union[Task, TaskChain]]",
+        ordered: bool = True,
+        max_in_flight: int = None,
+        chunksize: int = None,
+    ) -> Iterator[Any]:
+        """
+        Execute tasks lazily, yielding the results as they become available.
+
+        Tasks are pulled from the iterable only when there is room for them,
+        so arbitrarily long (or infinite) iterables run in constant memory.
+
+        REQUIRED
+        --------
+        tasks: iterable
+            Iterable of tasks to execute, e.g. a generator.
+
+        OPTIONAL
+        --------
+        ordered: bool
+            True: (default) results are yielded in the order of the tasks.
+            False: results are yielded in the order they complete.
+        max_in_flight: int
+            Maximum number of tasks that have been pulled from the iterable, but whose results have not been yielded yet.
+            When ordered, this includes finished results waiting for a slower task before them.
+            Default: 2 * chunksize * the number of workers, which follows the pool as it grows (see max_workers
+            and listen).
+        chunksize: int
+            None: (default) Use the chunksize of the TaskManager ('auto' is treated as 1).
+            int: Number of tasks sent to a worker in one message.
+
+        If the consumer stops iterating early, or an exception is raised, the tasks that have not
+        finished are cancelled (see interrupt_running).
+        """
+        chunksize = self.chunksize if chunksize is None else chunksize
+        _check_chunksize(chunksize)
+        if chunksize == CHUNKSIZE_AUTO:
+            chunksize = 1
+        if max_in_flight is not None and (not isinstance(max_in_flight, int) or max_in_flight < 1):
+            raise ValueError(f"max_in_flight must be a positive integer, got {max_in_flight!r}")
+        self._flush_submitted()
+
+        tasks = iter(tasks)
+        in_flight: dict[int, Tuple[int, Union[Task, TaskChain]]] = {}
+        done: dict[int, Any] = {}  # index -> result, for results waiting for their turn when ordered.
+        next_index = 0  # index of the next task pulled from the iterable.
+        next_yield = 0  # index of the next result to yield when ordered.
+        exhausted = False
+        sink = queue.SimpleQueue()
+
+        try:
+            while True:
+                window = max_in_flight or 2 * chunksize * self._workers()
+                while not exhausted and len(in_flight) + len(done) < window:
+                    chunk = list(islice(tasks, min(chunksize, window - len(in_flight) - len(done))))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    for t in chunk:
+                        in_flight[t.id] = (next_index, t)
+                        self._open_tasks.add(t.id)
+                        self._routes[t.id] = sink
+                        next_index += 1
+                    self._put_chunks(chunk, len(chunk))
+
+                if not in_flight:
+                    break
+
+                received, _ = self._receive(sink)
+                finished = [(task_key, in_flight.pop(task_key), success, res) for task_key, (success, res) in received]
+                for task_key, *_ in finished:
+                    self._open_tasks.discard(task_key)
+                    self._routes.pop(task_key, None)
+
+                ready = []
+                for task_key, (idx, t), success, res in finished:
+                    if not success and self.error_mode == ERR_MODE_EXCEPTION:
+                        raise unpickle_exception(res)
+
+                    if _resolved_by_parent(t):
+                        t = t.resolve(res)
+                        in_flight[task_key] = (idx, t)
+                        self._open_tasks.add(task_key)
+                        self._routes[task_key] = sink
+                        self._put_chunks([t], 1)
+                    elif ordered:
+                        done[idx] = res
+                    else:
+                        ready.append(res)
+
+                yield from ready
+                while next_yield in done:
+                    yield done.pop(next_yield)
+                    next_yield += 1
+        finally:
+            if in_flight:
+                self._cancel(set(in_flight), self.interrupt_running)
+            for task_key in in_flight:  # results that still arrive are dropped by the collector.
+                self._routes.pop(task_key, None)
+                self._open_tasks.discard(task_key)
+
+    async def run(self, task: Union[Task, TaskChain]):
+        """
+        Execute a task (or a TaskChain) from asyncio, without blocking the event loop.
+
+        The collector thread completes the task's Future, which wakes the event loop through
+        loop.call_soon_threadsafe, so nothing sleeps or polls while waiting.
+
+        REQUIRED
+        --------
+        task: Task | TaskChain
+            Task to execute.
+        """
+        import asyncio  # loaded already by the event loop, mplite doesn't import it for everybody.
+
+        t = task
+        while _resolved_by_parent(t):
+            t = t.resolve(await asyncio.wrap_future(self.submit(t.task)))
+        return await asyncio.wrap_future(self.submit(t))
+
+    async def amap(
+        self,
+        tasks: "Union[Iterable[Union[Task, TaskChain]], AsyncIterable[Union[Task, TaskChain]]]",
+        ordered: bool = True,
+        max_in_flight: int = None,
+    ) -> AsyncIterator[Any]:
+        """
+        Execute tasks from asyncio, yielding the results as they become available.
+
+        REQUIRED
+        --------
+        tasks: iterable | async iterable
+            Tasks to execute, pulled lazily.
+
+        OPTIONAL
+        --------
+        ordered: bool
+            True: (default) results are yielded in the order of the tasks.
+            False: results are yielded in the order they complete.
+        max_in_flight: int
+            Maximum number of tasks that have been pulled, but whose results have not been yielded yet.
+            Default: 2 * the number of workers, which follows the pool as it grows (see max_workers and listen).
+        """
+        import asyncio
+
+        if max_in_flight is not None and (not isinstance(max_in_flight, int) or max_in_flight < 1):
+            raise ValueError(f"max_in_flight must be a positive integer, got {max_in_flight!r}")
 
-    def take(self):
-        """ permits asynchronous retrieval of results """
+        is_async = hasattr(tasks, "__aiter__")
+        source = tasks.__aiter__() if is_async else iter(tasks)
+
+        async def next_task():
+            try:
+                return (await source.__anext__()) if is_async else next(source)
+            except (StopIteration, StopAsyncIteration):
+                return None
+
+        in_flight = deque()  # asyncio tasks, in the order of the tasks.
+        exhausted = False
         try:
-            task_id, (success, result) = self.rq.get_nowait()
+            while True:
+                while not exhausted and len(in_flight) < (max_in_flight or 2 * self._workers()):
+                    t = await next_task()
+                    if t is None:
+                        exhausted = True
+                    else:
+                        in_flight.append(asyncio.ensure_future(self.run(t)))
+                self._flush_submitted()
+
+                if not in_flight:
+                    break
+
+                if ordered:
+                    yield await in_flight.popleft()
+                    continue
+
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for f in [f for f in in_flight if f in done]:
+                    in_flight.remove(f)
+                    yield f.result()
+        finally:
+            for f in in_flight:  # cancels the tasks too, through their Futures.
+                f.cancel()
+
+    def _put_chunks(self, tasks: "list[Union[Task, TaskChain]]", chunksize: int, as_chunk: bool = False) -> "list[Union[Task, TaskChain]]":
+        """ dispatches tasks, `chunksize` tasks per message. returns the tasks sent, without those answered by the result_cache. """
+        if self.result_cache is not None:
+            tasks = self._memoize(tasks)
+        messages = []
+        for start in range(0, len(tasks), chunksize):
+            chunk = [self._encode(t) for t in tasks[start:start + chunksize]]
+            messages.append(chunk if as_chunk or len(chunk) > 1 else chunk[0])
+        self._dispatch(*messages)
+        return tasks
+
+    def _memoize(self, tasks: "list[Union[Task, TaskChain]]") -> "list[Union[Task, TaskChain]]":
+        """
+        routes the cached results of tasks, and holds back the tasks identical to a task that runs already.
+        returns the tasks to run.
+        """
+        run, hits = [], []
+        for t in tasks:
+            key = self.result_cache.key(t) if type(t) is Task and t.f is not _keep_in_worker else None
+            if key is not None:
+                found, result = self.result_cache.get(key)
+                if found:
+                    hits.append((t.id, (True, result)))
+                    continue
+                with self._memo_lock:
+                    leader = self._memo_leaders.get(key)
+                    if leader is not None:
+                        self._memo_followers.setdefault(leader, []).append(t)
+                        continue
+                    self._memo_leaders[key], self._memo_keys[t.id] = t.id, key
+            run.append(t)
+        for hit in hits:  # the tasks may have different routes.
+            self._route([hit], None)
+        return run
+
+    def _release(self, task_id: int) -> "Tuple[bytes, list[Task]]":
+        """ ends the run of a task for the result_cache, returns its key and the tasks that wait for its result. """
+        with self._memo_lock:
+            key = self._memo_keys.pop(task_id, None)
+            if key is None:
+                return None, []
+            self._memo_leaders.pop(key, None)
+            return key, self._memo_followers.pop(task_id, [])
+
+    def _dispatch(self, *messages, first: bool = False):
+        """ queues encoded messages for the workers, `first` puts them before the messages already waiting. """
+        if self._inline is not None:
+            self._run_inline(messages)
+            return
+        with self._dispatch_lock:
+            if self._stats is not None:
+                now = time.monotonic()
+                for message in messages:
+                    self._stats._enqueued(message, now)
+            for message in messages:
+                priority, lane = 0, None
+                if self._priorities:  # a chunk has the priority of its most important task.
+                    priority = max(self._priorities.pop(task_id, 0) for task_id in _message_ids(message))
+                if self._affinities:  # and the affinity of its first task with an affinity key.
+                    keys = [key for key in (self._affinities.pop(task_id, None) for task_id in _message_ids(message)) if key is not None]
+                    if keys and self.pool:
+                        lane = self._affine_worker(keys[0]).name
+                self._pending.push(message, priority, first, lane)
+            self._assign()
+
+    def _run_inline(self, messages: "tuple[Union[tuple, list], ...]"):
+        """ the inline backend: runs the messages in the calling thread, and routes their results. """
+        for message in messages:
+            if self._priorities or self._affinities:  # no queue to order.
+                for task_id in _message_ids(message):
+                    self._priorities.pop(task_id, None)
+                    self._affinities.pop(task_id, None)
+            if self._stats is not None:
+                self._stats._enqueued(message, time.monotonic())
+                self._stats._sent(message, self._inline.name)
+            if isinstance(message, list):
+                start = time.perf_counter()
+                results = [self._inline.execute(m) for m in message]
+                elapsed = time.perf_counter() - start
+            else:
+                results, elapsed = [self._inline.execute(message)], None
+            if self._stats is not None:
+                self._stats._received(self._inline.name, self._inline.timings)
+                self._inline.timings = []
+            self._route(results, elapsed)
+
+    def _affine_worker(self, key: Hashable) -> Worker:
+        """
+        the worker for an affinity key: rendezvous hashing on the worker names, which replacements keep,
+        so that a key keeps its worker for as long as the pool has a worker of that name. holds _dispatch_lock.
+        """
+        return max(self.pool, key=lambda w: hash((key, w.name)))
+
+    def _assign(self):
+        """
+        sends waiting messages to the workers that are down to half their prefetch, in turns starting with
+        the workers with the fewest messages, until they are full. holds _dispatch_lock.
+        """
+        if self._pending:
+            # filling up in batches wakes up the queues' feeder threads less often.
+            hungry = sorted((w for w in self.pool if w.ready and len(w.in_flight) <= w.prefetch // 2), key=lambda w: len(w.in_flight) / w.prefetch)
+            while self._pending and hungry:
+                for worker in list(hungry):
+                    if not self._pending:
+                        break
+                    message = self._pending.pop(worker.name)
+                    if message is None:  # the waiting messages are for other workers, see Task.with_affinity
+                        hungry.remove(worker)
+                        continue
+                    self._send(worker, message)
+                    if len(worker.in_flight) >= worker.prefetch:
+                        hungry.remove(worker)
+            if self._pending.lanes:
+                self._overflow()
+        if self.work_stealing and not self._pending:
+            self._steal()
+
+    def _send(self, worker: Worker, message: Union[tuple, list]):
+        """ holds _dispatch_lock. """
+        if self._stats is not None:
+            self._send_measured(worker, message)
+            return
+        worker.in_flight[_message_key(message)] = message
+        worker.tq.put(message)
+
+    def _send_measured(self, worker: Worker, message: Union[tuple, list]):
+        """ _send with telemetry: pickles the message, to record its size and the time taken. holds _dispatch_lock. """
+        size = dumps = None
+        data = message
+        if worker.backend in ("process", "remote"):  # threads take the message as it is.
+            start = time.perf_counter()
+            data = bytes(ForkingPickler.dumps(message))  # the queue copies the bytes, the worker unpickles them.
+            dumps, size = time.perf_counter() - start, len(data)
+        worker.in_flight[_message_key(message)] = message
+        worker.tq.put(data)
+        self._stats._sent(message, worker.name, size, dumps)
+
+    def _overflow(self):
+        """
+        gives the workers that have nothing to do the messages waiting for a worker (by affinity key)
+        that has no room for them, or that has left the pool. holds _dispatch_lock.
+        """
+        with_room = None
+        for worker in self.pool:
+            if worker.in_flight or not worker.ready:
+                continue
+            if with_room is None:
+                with_room = {w.name for w in self.pool if len(w.in_flight) < w.prefetch}
+            message = self._pending.pop_overflow(skip=with_room)
+            if message is None:
+                return
+            self._send(worker, message)
+
+    def _steal(self):
+        """
+        hands the last message that a busy worker holds but has not started to an idle worker, for as long as
+        there are idle workers. holds _dispatch_lock.
+        """
+        for thief in self.pool:
+            if thief.in_flight or not thief.ready:
+                continue
+            # remote workers have no lock, they can only steal.
+            victim = max((w for w in self.pool if w.lock is not None), key=lambda w: len(w.in_flight) - len(w.stolen), default=None)
+            if victim is None or len(victim.in_flight) - len(victim.stolen) < 2:  # nothing queued behind a running message.
+                return
+            # the victim cannot start a message meanwhile, see Worker.claim. A process killed while it
+            # holds the lock never releases it, hence the timeout: its replacement is on the way.
+            if not victim.lock.acquire(timeout=_WATCHDOG_INTERVAL):
+                return
+            try:
+                # the worker runs its messages in order, and has started those it did not answer yet.
+                started = int(victim.status[3]) - victim.answered
+                unstarted = [key for key in list(victim.in_flight)[started:] if key not in victim.stolen]
+                if not unstarted:
+                    continue
+                key = unstarted[-1]
+                message = victim.in_flight[key]
+                victim.stolen.add(key)  # kept in in_flight until the victim answers it with skipped results.
+                victim.tq.put(("steal", _message_ids(message)))
+                victim.status[2] += 1
+            finally:
+                victim.lock.release()
+            self._send(thief, message)
+
+    def _encode(self, task: Union[Task, TaskChain]) -> tuple:
+        """ encodes a task for the task queue: (task.id, function id or function, args, kwargs) """
+        timeout = (task.task if isinstance(task, TaskChain) else task).timeout
+        if timeout is None:
+            timeout = self.task_timeout
+        if timeout is not None and self.backend == "process":
+            if not self._timeouts and self._wakeup is not None:
+                self._wakeup.send("watchdog")  # the collector may be sleeping without a timeout.
+            self._timeouts[task.id] = timeout
+        priority = (task.task if isinstance(task, TaskChain) else task).priority
+        if priority:
+            self._priorities[task.id] = priority
+        affinity = (task.task if isinstance(task, TaskChain) else task).affinity
+        if affinity is not None:
+            self._affinities[task.id] = affinity
+        if self._stats is not None:
+            self._stats.names[task.id] = (_function_name((task.task if isinstance(task, TaskChain) else task).f), _resolved_by_parent(task))
+        if isinstance(task, TaskChain):
+            if task.resolve_in_worker:
+                return task.id, task if self.serializer is None else _Packed.dumps(task, self.serializer), None, None
+            task = task.task
+        f = self._function_id(task.f, task.id)
+        if self.serializer is not None and type(f) is not int:
+            f = _Packed.dumps(f, self.serializer)
+        if self.shared_memory_threshold is not None:
+            return task.id, f, _SharedPayload.dumps((task.args, task.kwargs), self.shared_memory_threshold), None
+        if self.serializer is not None:
+            return task.id, f, _Packed.dumps((task.args, task.kwargs), self.serializer), None
+        return task.id, f, task.args, task.kwargs
+
+    def _function_id(self, f: Callable, task_id: int = None) -> Union[int, Callable]:
+        """
+        returns the id of a registered function, registering it with all workers on first use.
+        the function stays registered until the task task_id is done, see _release_functions.
+        """
+        if not self.function_registry or self.backend != "process":  # threads share the functions anyway.
+            return f
+        try:
+            hash(f)
+        except TypeError:  # unhashable callable, it goes with every task.
+            return f
+
+        with self._register_lock:
+            fid = self._functions.get(f)
+            if fid is None:
+                # raises here, rather than in the queue's feeder thread.
+                pickled = bytes(ForkingPickler.dumps(f)) if self.serializer is None else self.serializer.dumps(f)
+                fid = next(self._function_ids)
+                for worker in self.pool:  # queued before any task using it, so the worker always finds it.
+                    worker.tq.put(("register", fid, pickled))
+                self._pickled_functions[fid] = pickled
+                self._functions[f] = fid
+                self._evict_functions()
+            else:
+                self._functions.move_to_end(f)
+            if task_id is not None:
+                self._function_uses[fid] = self._function_uses.get(fid, 0) + 1
+                self._task_functions[task_id] = fid
+        return fid
+
+    def _evict_functions(self):
+        """
+        drops the least recently used functions beyond _FUNCTION_REGISTRY_SIZE that no open task uses, also from
+        the workers. a message using a function may be in any queue or sent again, until its task is done.
+        holds _register_lock.
+        """
+        for f, fid in list(self._functions.items())[:-1]:  # not the function just registered.
+            if len(self._functions) <= _FUNCTION_REGISTRY_SIZE:
+                return
+            if self._function_uses.get(fid):
+                continue
+            del self._functions[f]
+            del self._pickled_functions[fid]
+            for worker in self.pool:
+                worker.tq.put(("unregister", fid))
+
+    def _release_functions(self, task_ids: Iterable[int]):
+        """ the tasks are done: their functions may be dropped from the registry. """
+        with self._register_lock:
+            for task_id in task_ids:
+                fid = self._task_functions.pop(task_id, None)
+                if fid is not None:
+                    self._function_uses[fid] -= 1
+                    if not self._function_uses[fid]:
+                        del self._function_uses[fid]
+            if len(self._functions) > _FUNCTION_REGISTRY_SIZE:
+                self._evict_functions()
+
+    def _auto_chunksize(self, task_duration: float, remaining: int) -> int:
+        """
+        picks a chunksize so that a chunk takes about _AUTO_CHUNK_DURATION seconds of work,
+        while leaving at least 4 chunks per worker, so that the workers finish at about the same time.
+        """
+        by_duration = _AUTO_CHUNK_DURATION / task_duration if task_duration > 0 else remaining
+        by_balance = math.ceil(remaining / (max(len(self.pool), 1) * 4))  # remote workers count, see listen.
+        return max(1, min(int(by_duration), by_balance))
+
+    def _idle_worker(self) -> bool:
+        """ True if a worker has nothing to do, so that partial chunks are better sent than held back. """
+        return any(w.ready and not w.in_flight for w in self.pool)
+
+    def _linger(self) -> Union[float, None]:
+        """
+        called by the collector: sends the partial chunk of submit once it waited _SUBMIT_LINGER seconds or a
+        worker ran out of work, so that futures complete without being asked. returns the seconds until then.
+        """
+        remaining = self._submitted_since + _SUBMIT_LINGER - time.monotonic()
+        if remaining > 0 and not self._idle_worker():
+            return remaining
+        self._flush_submitted()
+        return None
+
+    def _flush_submitted(self):
+        """ puts tasks that submit is holding back for a full chunk on the task queue. """
+        with self._submit_lock:
+            if self._submitted:
+                self._put_chunks(self._submitted, len(self._submitted))
+                self._submitted = []
+
+    @staticmethod
+    def _unpack(message):
+        """ unpacks a message from the result queue into ([(task.id, result), ...], seconds spent or None) """
+        if isinstance(message[0], list):  # a chunk of results.
+            return message
+        return [message], None
+
+    def _receive(self, sink: queue.SimpleQueue):
+        """ blocks until the collector routes results to the sink, returns ([(task.id, result), ...], seconds spent or None) """
+        if self._broken is not None and sink.empty():
+            raise self._broken
+        item = sink.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def _collect(self, wakeup: connection.Connection):
+        """
+        runs in a background thread: routes the results from the workers to whoever waits for them.
+
+        instead of polling, the thread sleeps in the OS until either a worker's result pipe becomes readable,
+        one of the worker processes exits (its sentinel becomes ready), or it is woken up to stop.
+        """
+        while True:
+            with self._dispatch_lock:
+                watched = self.pool + self._retiring
+                workers = {w.results: w for w in watched}
+                sentinels = {w.process.sentinel: w for w in watched if w.process.sentinel is not None}  # not for threads.
+            timeout = self._watchdog() if self._timeouts else None
+            if self._server is not None:
+                heartbeats = self._heartbeats()
+                timeout = heartbeats if timeout is None else min(timeout, heartbeats)
+            if self._submitted:
+                linger = self._linger()
+                if linger is not None:
+                    timeout = linger if timeout is None else min(timeout, linger)
+            ready = connection.wait([*workers, wakeup, *sentinels], timeout)
+
+            for r in ready:
+                if r not in workers:
+                    continue
+                while True:  # all results that arrived, before sleeping again.
+                    if not self._read(workers[r]):
+                        self._lost(workers[r])
+                        break
+                    if not r.poll():
+                        break
+
+            if wakeup in ready and wakeup.recv() == "stop":
+                return
+
+            for s in ready:
+                if s in sentinels and (sentinels[s] in self.pool or sentinels[s] in self._retiring):
+                    self._lost(sentinels[s])
+
+    def _read(self, worker: Worker) -> bool:
+        """
+        called by the collector: routes one result message of a worker, and sends the worker more work.
+        returns False when the process died, possibly half way through a message.
+        """
+        size = loads = None
+        try:
+            if self._stats is not None and worker.backend in ("process", "remote"):
+                data = worker.results.recv_bytes()  # what recv does, measured.
+                start = time.perf_counter()
+                message = ForkingPickler.loads(data)
+                loads, size = time.perf_counter() - start, len(data)
+            else:
+                message = worker.results.recv()
+        except (EOFError, OSError):
+            return False
+        if worker.backend == "remote":
+            worker.last_seen = time.monotonic()
+        if type(message) is str:  # "ready", "retire" or "heartbeat"
+            if message == "retire":
+                self._retire(worker)
+            elif message == "ready":
+                self._ready(worker)
+            return True
+        if type(message) is tuple and message[0] == "ready":  # with telemetry: ("ready", pid, init started, init ended)
+            self._ready(worker, *message[1:])
+            return True
+        timings = None
+        if type(message) is _Timed:
+            message, timings = message.message, message.timings
+        received, elapsed = self._unpack(message)
+        now = time.perf_counter()
+        with self._dispatch_lock:
+            if timings is not None:
+                self._stats._received(worker.name, timings, size, loads)
+            if worker.last_result is not None and len(worker.in_flight) > 1:  # busy since the last result.
+                duration = now - worker.last_result
+                worker.message_duration = duration if worker.message_duration is None else 0.8 * worker.message_duration + 0.2 * duration
+                # short messages need a deeper queue to keep the worker busy, long ones a shallow one to keep the workers balanced.
+                worker.prefetch = max(_PREFETCH, min(_MAX_PREFETCH, int(_PREFETCH_DURATION / max(worker.message_duration, 1e-9))))
+            worker.last_result = now
+            key = received[0][0]
+            worker.in_flight.pop(key, None)
+            worker.answered += 1
+            stolen = key in worker.stolen
+            if stolen:
+                worker.stolen.discard(key)  # the skipped tasks, another worker runs them.
+            self._assign()
+        if stolen:
+            return True
+        self._deaths = 0
+        if self._attempts or self._timeouts or self._cancelled:
+            for task_id, _ in received:
+                self._attempts.pop(task_id, None)
+                self._timeouts.pop(task_id, None)
+                self._cancelled.discard(task_id)
+        self._route(received, elapsed)
+        return True
+
+    def _watchdog(self) -> float:
+        """
+        called by the collector: terminates the workers running a task for longer than its timeout,
+        returns the seconds until the next check.
+        """
+        now, next_check = time.monotonic(), _WATCHDOG_INTERVAL
+        for worker in self.pool + self._retiring:
+            task_id = int(worker.status[0])  # read before the time, see Worker.execute
+            started = worker.status[1]
+            timeout = self._timeouts.get(task_id)
+            if timeout is None or worker.terminated is not None:
+                continue
+            remaining = started + timeout - now
+            if remaining <= 0:
+                worker.terminated = task_id
+                worker.process.kill()  # its sentinel wakes the collector, which replaces it.
+            else:
+                next_check = min(next_check, remaining)
+        return next_check
+
+    def _heartbeats(self) -> float:
+        """
+        called by the collector: disconnects the remote workers that sent nothing for heartbeat_timeout seconds,
+        returns the seconds until the next check.
+        """
+        now, next_check = time.monotonic(), self.heartbeat_timeout
+        for worker in self.pool:
+            if worker.backend != "remote":
+                continue
+            remaining = worker.last_seen + self.heartbeat_timeout - now
+            if remaining <= 0:
+                worker.process.kill()  # the collector reads the EOF, and treats the worker as lost.
+            else:
+                next_check = min(next_check, remaining)
+        return next_check
+
+    def _lost(self, worker: Worker):
+        """
+        called by the collector when a worker process ended: unless the pool is stopping, the worker is replaced,
+        the messages it had not started are sent to other workers, and the task it was running is retried
+        (or fails with ChildProcessError once it was lost max_retries + 1 times).
+        A remote worker whose connection closed is lost in the same way, but it is not replaced.
+        """
+        worker.process.join()  # the sentinel may fire before the process can be reaped.
+        while worker.results.poll() and self._read(worker):  # a worker may have sent results before it died.
+            pass
+        with self._dispatch_lock:
+            retired = worker in self._retiring
+            (self._retiring if retired else self.pool).remove(worker)
+            if self._stats is not None and not retired:
+                self._stats._stopped(worker.name)
+            lost, worker.in_flight = [m for k, m in worker.in_flight.items() if k not in worker.stolen], {}
+        worker.close()
+        if self._stopping or retired:  # a retired worker has been replaced already, and holds no tasks.
+            return
+
+        lost = self._without_cancelled(lost)
+        if worker.terminated is not None:
+            self._terminated(worker, lost)
+            return
+
+        if worker.backend == "remote":
+            error = ChildProcessError(f"Remote worker {worker.name} lost its connection or missed its heartbeats.")
+        elif worker.exitcode == -9:
+            error = ChildProcessError(f"Worker {worker.name} was killed, likely because system ran out of memory. Exit code: {worker.exitcode}")
+        else:
+            error = ChildProcessError(f"Worker {worker.name} exited abruptly. Exit code: {worker.exitcode}")
+
+        if worker.backend != "remote":  # nodes that leave don't mean that workers cannot start.
+            self._deaths += 1
+        if self._deaths > max(self._cpus, 1) * (self.max_retries + 2):  # workers die without completing anything.
+            with self._dispatch_lock:
+                self._pending.clear()
+            self._fail(error)
+            return
+
+        retry, failed = [], []
+        if lost:
+            # the worker runs its messages in order, so only the first one may have started.
+            # a chunk is split up, so that only the task that killed the worker fails.
+            running = lost.pop(0)
+            for message in ([[m] for m in running] if isinstance(running, list) else [running]):
+                task_id = _message_key(message)
+                self._attempts[task_id] = self._attempts.get(task_id, 0) + 1
+                if self._attempts[task_id] > self.max_retries:
+                    failed.append(task_id)
+                    del self._attempts[task_id]
+                else:
+                    retry.append(message)
+
+        if worker.backend != "remote":
+            self._spawn(worker.name)
+        self._dispatch(*retry, *lost, first=True)
+        self._lose(failed, error)
+
+    def _retire(self, worker: Worker):
+        """
+        called by the collector: the worker reached max_tasks_per_worker or max_worker_rss and stopped taking tasks.
+        it is replaced right away, and the tasks it had not started go to the other workers, so no core idles.
+        """
+        with self._dispatch_lock:
+            self.pool.remove(worker)
+            self._retiring.append(worker)
+            if self._stats is not None:
+                self._stats._stopped(worker.name)
+            unstarted, worker.in_flight = [m for k, m in worker.in_flight.items() if k not in worker.stolen], {}
+        worker.tq.put("stop")
+        if not self._stopping:
+            self._spawn(worker.name)
+        self._dispatch(*unstarted, first=True)
+
+    def _terminated(self, worker: Worker, lost: "list[Union[tuple, list]]"):
+        """
+        called by the collector for a worker terminated by the watchdog or cancel: only the task
+        it was terminated for fails (with TimeoutError, or not at all if it was cancelled).
+        """
+        task_id, retry = worker.terminated, []
+        for message in lost:
+            if isinstance(message, list) and any(m[0] == task_id for m in message):
+                retry.extend([m] for m in message if m[0] != task_id)  # the tasks of the chunk that ran are lost too.
+            elif _message_key(message) != task_id:
+                retry.append(message)
+
+        self._spawn(worker.name)
+        self._dispatch(*retry, first=True)
+        timeout = self._timeouts.pop(task_id, None)
+        if timeout is not None and task_id in self._routes:  # not a cancelled task.
+            do_task = _do_task_for(self.error_mode)
+            error = TimeoutError(f"Task {task_id} did not finish within {timeout} seconds, its worker was replaced.")
+            self._route([(task_id, do_task(_raise, (error,), {}))], timeout)  # it ran for timeout seconds.
+
+    def _without_cancelled(self, messages: "list[Union[tuple, list]]") -> "list[Union[tuple, list]]":
+        """ removes the cancelled tasks from messages that a dead worker held. """
+        if not self._cancelled:
+            return messages
+        kept = []
+        for message in messages:
+            if isinstance(message, list):
+                _release_shared([m for m in message if m[0] in self._cancelled])
+                message = [m for m in message if m[0] not in self._cancelled] or None
+            elif message[0] in self._cancelled:
+                _release_shared(message)
+                message = None
+            if message is not None:
+                kept.append(message)
+        self._cancelled.difference_update(task_id for message in messages for task_id in _message_ids(message))
+        return kept
+
+    def _cancel(self, task_ids: "set[int]", interrupt: bool):
+        """
+        drops the tasks that have not been sent to a worker, tells the workers to skip those they hold,
+        and terminates the workers running one of them if interrupt. Routes are left to the caller.
+        """
+        with self._dispatch_lock:
+            self._pending.remove(task_ids)
+
+            for worker in self.pool:
+                held = [i for message in worker.in_flight.values() for i in _message_ids(message) if i in task_ids]
+                if not held:
+                    continue
+                self._cancelled.update(held)
+                worker.tq.put(("cancel", held))
+                worker.status[2] += 1  # the worker reads ahead to the cancel message before its next task.
+                running = int(worker.status[0])
+                if interrupt and running in task_ids and worker.terminated is None and self.backend == "process":
+                    worker.terminated = running
+                    worker.process.kill()  # see _watchdog
+        for task_id in task_ids:
+            self._timeouts.pop(task_id, None)
+        if self._stats is not None:  # skipped tasks don't report timings.
+            for task_id in task_ids:
+                self._stats.open.pop(task_id, None)
+        if self._task_functions:
+            self._release_functions(task_ids)
+        if self._memo_keys:
+            self._promote(task_ids)
+
+    def _promote(self, task_ids: "set[int]"):
+        """ cancelled tasks that identical tasks wait for hand their run to the first of those still open. """
+        promoted = []
+        for task_id in task_ids:
+            key, followers = self._release(task_id)
+            followers = [t for t in followers if t.id in self._routes and t.id not in task_ids]
+            if not followers:
+                continue
+            with self._memo_lock:
+                leader = followers.pop(0)
+                self._memo_leaders[key], self._memo_keys[leader.id] = leader.id, key
+                if followers:
+                    self._memo_followers[leader.id] = followers
+            promoted.append(leader)
+        if promoted:
+            self._dispatch(*[self._encode(t) for t in promoted])
+
+    def cancel(self, task_id: int, interrupt: bool = None) -> bool:
+        """
+        Cancels an open task (submitted, or part of a running execute or imap call).
+
+        A task that has not started is dropped. A running task runs to completion and its result is discarded,
+        or, if interrupt, its worker is terminated and replaced.
+        Its Future raises CancelledError, execute and imap handle it like a task that raised CancelledError.
+
+        REQUIRED
+        --------
+        task_id: int
+            Task.id of the task.
+
+        OPTIONAL
+        --------
+        interrupt: bool | None
+            None: (default) use interrupt_running of the TaskManager.
+
+        returns False if the task is not open (e.g. it has finished), True otherwise.
+        """
+        self._flush_submitted()  # so that the task can be found.
+        sink = self._routes.pop(task_id, None)  # the collector won't deliver its result anymore.
+        if sink is None:
+            return False
+        self._cancel({task_id}, self.interrupt_running if interrupt is None else interrupt)
+        self._open_tasks.discard(task_id)
+        if isinstance(sink, queue.SimpleQueue):
+            do_task = _do_task_for(self.error_mode)
+            sink.put(([(task_id, do_task(_raise, (futures.CancelledError(f"Task {task_id} was cancelled."),), {}))], None))
+        else:
+            sink.set_exception(futures.CancelledError(f"Task {task_id} was cancelled."))
+            self._completed_future(sink)
+        return True
+
+    def _lose(self, task_ids: "list[int]", error: BaseException):
+        """ called by the collector: the tasks failed because their worker died. """
+        if self._memo_keys:  # and so did the tasks waiting for them.
+            task_ids = list(task_ids) + [t.id for task_id in task_ids for t in self._release(task_id)[1]]
+        for task_id in task_ids:
+            sink = self._routes.pop(task_id, None)
+            self._open_tasks.discard(task_id)
+            self._timeouts.pop(task_id, None)
+            if self._stats is not None:
+                self._stats.open.pop(task_id, None)
+            if isinstance(sink, queue.SimpleQueue):
+                sink.put(error)  # the execute/imap call raises it.
+            elif sink is not None:
+                sink.set_exception(error)
+                self._completed_future(sink)
+
+    def _route(self, received: "list[Tuple[int, Tuple[bool, Any]]]", elapsed: float):
+        """ called by the collector: hands results to the execute/imap call or Futures waiting for them. """
+        if self.shared_memory_threshold is not None:
+            # results nobody waits for are loaded too, that releases their shared memory.
+            do_task = _do_task_for(self.error_mode)
+            received = [
+                (task_id, do_task(res.loads, (), {}) if type(res) is _SharedPayload and not res.kept else (success, res))
+                for task_id, (success, res) in received
+            ]
+        elif self.serializer is not None:
+            do_task = _do_task_for(self.error_mode)
+            received = [
+                (task_id, do_task(self.serializer.loads, (res.data,), {}) if type(res) is _Packed else (success, res))
+                for task_id, (success, res) in received
+            ]
+
+        if self._task_functions:
+            self._release_functions(task_id for task_id, _ in received)
+        if self._memo_keys:
+            self._memoized(received)
+
+        sink = self._routes.get(received[0][0])
+        if len(received) > 1 and (sink is None or isinstance(sink, queue.SimpleQueue)):
+            routed = [r for r in received if r[0] in self._routes]  # without cancelled tasks.
+            if routed and len(routed) < len(received):
+                received, sink = routed, self._routes.get(routed[0][0])
+        if isinstance(sink, queue.SimpleQueue):  # chunks are never shared between calls.
+            sink.put((received, elapsed))
+            return
+
+        for task_id, (success, res) in received:
+            future = self._routes.pop(task_id, None)
+            if future is None:  # nobody is waiting for this result anymore.
+                if type(res) is _SharedPayload and res.kept:
+                    res.unlink()
+                continue
+            if success or self.error_mode != ERR_MODE_EXCEPTION:
+                future.set_result(res)
+            else:
+                future.set_exception(unpickle_exception(res))
+            self._completed_future(future)
+
+    def _memoized(self, received: "list[Tuple[int, Tuple[bool, Any]]]"):
+        """ called by the collector: caches the results of tasks that ran for the result_cache, and shares them with the tasks that waited. """
+        for task_id, (success, res) in received:
+            key = self._memo_keys.get(task_id)
+            if key is None:
+                continue
+            blob = self.result_cache.put(key, res) if success else None  # cached before identical tasks stop waiting for it.
+            _, followers = self._release(task_id)
+            for t in followers:
+                self._route([(t.id, (success, res if blob is None else pickle.loads(blob)))], None)
+
+    def _completed_future(self, future: Future):
+        with self._completed:
+            if future._manager is not None:  # not claimed, so take may return it.
+                self._unclaimed[future.task_id] = future
+                self._completed.notify_all()
+
+    def _fail(self, error: BaseException):
+        """ called by the collector: the pool is broken, everybody waiting for results gets the error instead. """
+        self._broken = error
+        routes, self._routes = self._routes, {}
+        for sink in set(routes.values()):
+            if isinstance(sink, queue.SimpleQueue):
+                sink.put(error)
+            else:
+                sink.set_exception(error)
+                self._completed_future(sink)
+        with self._completed:
+            self._completed.notify_all()
+        with self._workers_ready:  # start gives up waiting.
+            self._workers_ready.notify_all()
+
+    def _claim(self, task_id: int):
+        """ called by Future: the result is consumed through the future, so take must not return it. """
+        self._flush_submitted()  # the caller is about to wait, so partial chunks must be sent now.
+        with self._completed:
+            self._unclaimed.pop(task_id, None)
+            self._open_tasks.discard(task_id)
+            self._completed.notify_all()
+
+    def submit(self, task: Union[Task, TaskChain]) -> Future:
+        """
+        permits asynchronous submission of tasks.
+
+        returns a Future for the result of the task. The result can be obtained from the future,
+        or, if nobody asks the future for it, from take.
+
+        With chunksize > 1, tasks are held back until a chunk is full, a worker runs out of work, the
+        first of them waited 5 ms, or until take is called or a future is asked for its result or state.
+        """
+        if isinstance(task, TaskChain):
+            if _resolved_by_parent(task):
+                raise TypeError("submit only supports TaskChains with resolve_in_worker=True, use execute, imap or run instead.")
+        elif not isinstance(task, Task):
+            raise TypeError(f"expected mplite.Task, not {type(task)}")
+        if self._broken is not None:
+            raise self._broken
+        future = Future(task.id, manager=self)
+        future.set_running_or_notify_cancel()  # queued tasks cannot be withdrawn.
+        self._open_tasks.add(task.id)
+        self._routes[task.id] = future
+
+        if self.chunksize == CHUNKSIZE_AUTO or self.chunksize == 1:
+            self._put_chunks([task], 1)
+        else:
+            with self._submit_lock:
+                self._submitted.append(task)
+                if len(self._submitted) >= self.chunksize or self._idle_worker():
+                    self._flush_submitted()
+                elif len(self._submitted) == 1:
+                    self._submitted_since = time.monotonic()
+                    if self._wakeup is not None:
+                        self._wakeup.send("linger")  # the collector may be sleeping without a timeout.
+        return future
+
+    def take(self, timeout: float = 0):
+        """
+        permits asynchronous retrieval of results, in the order they complete.
+
+        OPTIONAL
+        --------
+        timeout: float | None
+            0: (default) return None immediately if no result is available.
+            float: wait up to timeout seconds for a result, then return None.
+            None: wait until a result is available (returns None if there are no open tasks).
+
+        results whose Future was asked for the result are not returned by take.
+        """
+        self._flush_submitted()  # the caller is waiting, so partial chunks must be sent now.
 
-            self._open_tasks.remove(task_id)
+        with self._completed:
+            if timeout != 0:
+                self._completed.wait_for(lambda: self._unclaimed or not self._open_tasks or self._broken, timeout)
+            future = self._unclaimed.popitem(last=False)[1] if self._unclaimed else None
 
-            if not success and self.error_mode == ERR_MODE_EXCEPTION:
-                raise unpickle_exception(result)
+        if future is None:
+            # callers typically poll take in a loop. Without releasing the GIL here the collector thread
+            # would only get to run once per switch interval (5 ms), delaying every result.
+            time.sleep(0)
+            return None
 
-        except queue.Empty:
-            result = None
-        return result
+        future._claim()
+        return future.result()
 
     @property
     def open_tasks(self):
         return len(self._open_tasks)
 
     def stop(self):
-        for _ in range(self._cpus):
-            self.tq.put('stop')
-        while any(p.is_alive() for p in self.pool):
-            time.sleep(0.01)
+        self._stopping = True
+        if self._scaler is not None:
+            self._scaler_stop.set()
+            self._scaler.join()
+            self._scaler = None
+        if self._server is not None:
+            try:  # closing the socket doesn't wake up accept on all platforms, a connection does.
+                socket.create_connection(self.address, timeout=1).close()
+            except OSError:
+                pass
+            self._server.close()
+            self._acceptor.join(timeout=1)
+            self._server = self._acceptor = None
+        with self._dispatch_lock:
+            running = list(self.pool)
+            workers = running + self._retiring  # retiring workers were told to stop already.
+            self._pending.clear()
+            if self._stats is not None:
+                for name in list(self._stats.ready):
+                    self._stats._stopped(name)
+                self._stats.open.clear()
+                self._stats.names.clear()
+        for p in running:
+            p.tq.put('stop')
+        for p in workers:
+            p.process.join()
+        if self._collector is not None:
+            self._wakeup.send("stop")
+            self._collector.join()
+            self._collector = None
+        for p in self.pool + self._retiring:
+            if p not in workers:  # replaced a worker while stopping.
+                p.tq.put('stop')
+                p.process.join()
+            p.close()
         self.pool.clear()
-        while not self.tq.empty:
-            _ = self.tq.get_nowait()
-        while not self.rq.empty:
-            _ = self.rq.get_nowait()
+        self._retiring.clear()
+        self._inline = None
+        self._timeouts.clear()
+        self._attempts.clear()
+        self._cancelled.clear()
+        with self._memo_lock:
+            self._memo_keys.clear()
+            self._memo_leaders.clear()
+            self._memo_followers.clear()
+        with self._register_lock:
+            self._task_functions.clear()
+            self._function_uses.clear()
+        if self.trace is not None:
+            self._stats.write_trace(self.trace)
+
+
+class _Pending(object):
+    """
+    the messages waiting for a worker, highest priority first, first in first out among equal priorities.
+    messages for a particular worker (see Task.with_affinity) wait in a lane of their own.
+
+    a message's effective priority is priority + aging * seconds waited. As all waiting messages age
+    at the same rate, their order only depends on priority - aging * time they were queued, which
+    therefore serves as a fixed heap key.
+    """
+    def __init__(self, aging: float) -> None:
+        self.aging = aging
+        self.heap = []  # [(key, sequence number, message)], for any worker.
+        self.lanes: dict[str, list] = {}  # worker name -> heap of the messages for that worker.
+        self.size = 0
+        self.since = None  # time.monotonic() when the messages started waiting, see TaskManager._scale
+        self.sequence = count()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def push(self, message, priority: float = 0, first: bool = False, lane: str = None):
+        """ queues a message, `first` puts it before all others (e.g. tasks of a worker that died). """
+        now = time.monotonic()
+        key = -math.inf if first else self.aging * now - priority
+        heapq.heappush(self.heap if lane is None else self.lanes.setdefault(lane, []), (key, next(self.sequence), message))
+        if not self.size:
+            self.since = now
+        self.size += 1
+
+    def pop(self, lane: str = None):
+        """ pops the first message for the worker of the lane or for any worker, None if there is none. """
+        own = self.lanes.get(lane) if self.lanes else None
+        if own and (not self.heap or own[0] < self.heap[0]):
+            return self._pop(lane)
+        return self._pop(None) if self.heap else None
+
+    def pop_overflow(self, skip: "set[str]"):
+        """ pops the first message of the longest lane not in skip, None if there is none. """
+        lanes = [lane for lane in self.lanes if lane not in skip]
+        return self._pop(max(lanes, key=lambda lane: len(self.lanes[lane]))) if lanes else None
+
+    def _pop(self, lane: str):
+        heap = self.heap if lane is None else self.lanes[lane]
+        message = heapq.heappop(heap)[2]
+        if not heap and lane is not None:
+            del self.lanes[lane]
+        self.size -= 1
+        return message
+
+    def remove(self, task_ids: "set[int]"):
+        """ removes the tasks from the waiting messages, and releases their shared memory. """
+        heaps = {}
+        for lane, old in [(None, self.heap), *self.lanes.items()]:
+            heap = []
+            for key, n, message in old:
+                if isinstance(message, list):
+                    _release_shared([m for m in message if m[0] in task_ids])
+                    message = [m for m in message if m[0] not in task_ids] or None
+                elif message[0] in task_ids:
+                    _release_shared(message)
+                    message = None
+                if message is not None:
+                    heap.append((key, n, message))
+            heapq.heapify(heap)
+            heaps[lane] = heap
+        self.heap = heaps.pop(None)
+        self.lanes = {lane: heap for lane, heap in heaps.items() if heap}
+        self.size = len(self.heap) + sum(len(heap) for heap in self.lanes.values())
+
+    def clear(self):
+        for heap in [self.heap, *self.lanes.values()]:
+            for _, _, message in heap:
+                _release_shared(message)
+        self.heap.clear()
+        self.lanes.clear()
+        self.size = 0
+
+
+class _LocalQueue(queue.SimpleQueue):
+    """ the task queue of a worker thread, with the methods of multiprocessing.Queue that the TaskManager uses. """
+    def cancel_join_thread(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _LocalPipe(object):
+    """
+    the result pipe of a worker thread: results are handed over as they are, without pickling. An empty message
+    per result on a real pipe makes it work with connection.wait, and reports EOF once the thread closed its writer.
+    """
+    def __init__(self) -> None:
+        self.results = deque()
+        self.reader, self.writer = connection.Pipe(duplex=False)
+
+    def send(self, obj):
+        self.results.append(obj)
+        self.writer.send_bytes(b"")
+
+    def recv(self):
+        self.reader.recv_bytes()  # raises EOFError once the writer is closed and all results were read.
+        return self.results.popleft()
+
+    def poll(self) -> bool:
+        return self.reader.poll()
+
+    def fileno(self) -> int:
+        return self.reader.fileno()
+
+    def close(self):
+        self.writer.close()
+        self.reader.close()
+
+
+class _ThreadProcess(threading.Thread):
+    """ runs a worker in a thread, with the parts of the multiprocessing.Process API that the TaskManager uses. """
+    sentinel = None  # the collector notices the end of the thread by the EOF of its _LocalPipe.
+
+    def __init__(self, target: Callable, name: str, on_exit: Callable) -> None:
+        super().__init__(name=f"mplite-worker-{name}", daemon=True)
+        self.work = target
+        self.on_exit = on_exit
+        self.exitcode = None
+
+    def run(self):
+        try:
+            self.work()
+            self.exitcode = 0
+        except BaseException:
+            traceback.print_exc()
+            self.exitcode = 1
+        finally:
+            self.on_exit()
+
+    def kill(self):
+        pass  # threads cannot be stopped from outside.
+
+
+class _RemoteQueue(object):
+    """
+    the task queue of a remote worker: messages are sent on its connection by a feeder thread, so that
+    put never blocks the dispatch, like multiprocessing.Queue.
+    """
+    def __init__(self, conn: connection.Connection) -> None:
+        self.conn = conn
+        self.messages = queue.SimpleQueue()
+        self.feeder = threading.Thread(target=self._feed, name="mplite-feeder", daemon=True)
+        self.feeder.start()
+
+    def put(self, message):
+        self.messages.put(message)
+
+    def _feed(self):
+        while True:
+            message = self.messages.get()
+            if message is None:
+                return
+            try:
+                self.conn.send(message)
+            except OSError:  # the agent is gone, the collector reads the EOF.
+                return
+
+    def cancel_join_thread(self):
+        pass
+
+    def close(self):
+        """ sends the messages put so far (e.g. "stop"), unless the agent doesn't take them within a second. """
+        self.messages.put(None)
+        self.feeder.join(timeout=1)
+
+
+class _RemoteProcess(object):
+    """ stands in for the process of a remote worker, which lives for as long as its connection. """
+    sentinel = None  # the collector notices the end of the connection by its EOF.
+    exitcode = None
+
+    def __init__(self, conn: connection.Connection, sock: socket.socket) -> None:
+        self.conn = conn
+        self.sock = sock  # the accepted socket, the connection uses a duplicate of its handle.
+
+    def is_alive(self) -> bool:
+        return not self.conn.closed
+
+    def join(self, timeout: float = None):
+        pass  # the agent stops after its running task, without the TaskManager waiting for it.
+
+    def kill(self):
+        """ disconnects the agent: the collector reads the EOF, and requeues the worker's tasks. """
+        try:  # shuts down the connection itself, which closing one of its handles wouldn't.
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:  # closed already.
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+class _OutOfBand(object):
+    """
+    wraps large bytes and bytearray objects so that they are pickled out-of-band:
+    unlike numpy arrays, the pickler always writes them into the pickle stream.
+    """
+    __slots__ = ("obj",)
+
+    def __init__(self, obj) -> None:
+        self.obj = obj
+
+    def __reduce_ex__(self, protocol):
+        return type(self.obj), (pickle.PickleBuffer(self.obj),)
+
+
+class _Timed(object):
+    """ a result message of a worker, with the (task id, started, ended) times of its tasks, see Worker.send """
+    __slots__ = ("message", "timings")
+
+    def __init__(self, message, timings: "list[Tuple[int, float, float]]") -> None:
+        self.message = message
+        self.timings = timings
+
+    def __reduce__(self):
+        return _Timed, (self.message, self.timings)
+
+
+class _Packed(object):
+    """ an object serialized by the Serializer of the TaskManager, the queues and pipes only copy its bytes. """
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def __reduce__(self):
+        return _Packed, (self.data,)
+
+    @classmethod
+    def dumps(cls, obj, serializer: Serializer) -> "_Packed":
+        return cls(serializer.dumps(obj))
+
+
+def _lz4():
+    """ the lz4.frame module, None if lz4 is not installed. """
+    try:
+        import lz4.frame
+    except ImportError:
+        return None
+    return lz4.frame
+
+
+def _mark_out_of_band(obj, threshold: int):
+    """ wraps large bytes and bytearray objects in obj and in the tuples, lists and dicts it contains """
+    t = type(obj)
+    if t is bytes or t is bytearray:
+        return _OutOfBand(obj) if len(obj) >= threshold else obj
+    if t is tuple or t is list:
+        return t(_mark_out_of_band(o, threshold) for o in obj)
+    if t is dict:
+        return {k: _mark_out_of_band(v, threshold) for k, v in obj.items()}
+    return obj
+
+
+class _AttachedSegment(shared_memory.SharedMemory):
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            pass  # unpickled objects still use the memory, it is unmapped when they are garbage collected.
+
+
+class _SharedPayload(object):
+    """
+    a pickled object whose large buffers travel in a shared memory segment instead of the pickle stream.
+
+    the receiver maps the segment and unlinks it right away, so the OS releases the memory
+    as soon as the last object using it (e.g. a numpy array) is garbage collected.
+
+    kept payloads (TaskGraph keep_in_worker) hold the pickle stream in the segment as well, and can be loaded
+    any number of times, until their owner unlinks them.
+    """
+    __slots__ = ("data", "segment", "sizes")
+
+    def __init__(self, data: bytes, segment: str = None, sizes: "list[int]" = None) -> None:
+        self.data = data
+        self.segment = segment
+        self.sizes = sizes
+
+    @classmethod
+    def dumps(cls, obj, threshold: int, keep: bool = False) -> "_SharedPayload":
+        buffers = []
+
+        def out_of_band(buffer: pickle.PickleBuffer):
+            try:
+                raw = buffer.raw()
+            except BufferError:  # not contiguous, stays in the pickle stream.
+                return True
+            if raw.nbytes < threshold:
+                return True
+            buffers.append(raw)
+            return False
+
+        data = pickle.dumps(_mark_out_of_band(obj, threshold), protocol=5, buffer_callback=out_of_band)
+        if keep:
+            buffers.insert(0, memoryview(data))
+        elif not buffers:
+            return cls(data)
+
+        sizes = [b.nbytes for b in buffers]
+        segment = shared_memory.SharedMemory(create=True, size=sum(sizes))
+        offset = 0
+        for b in buffers:
+            segment.buf[offset:offset + b.nbytes] = b
+            offset += b.nbytes
+        segment.close()  # the receiver opens it by name.
+        return cls(None if keep else data, segment.name, sizes)
+
+    @property
+    def kept(self) -> bool:
+        return self.data is None
+
+    def loads(self):
+        if self.segment is None:
+            return pickle.loads(self.data)
+
+        segment = _AttachedSegment(self.segment)
+        if not self.kept:
+            segment.unlink()
+        buffers, offset = [], 0
+        for size in self.sizes:
+            buffers.append(segment.buf[offset:offset + size])
+            offset += size
+        data = buffers.pop(0) if self.kept else self.data
+        return pickle.loads(data, buffers=buffers)
+
+    def unlink(self):
+        """ releases a kept payload, or one that is dropped without being loaded. """
+        segment = shared_memory.SharedMemory(self.segment)
+        segment.close()
+        segment.unlink()
+
+
+class _SharedArgument(object):
+    """ a kept payload passed as argument, it is loaded when the worker unpickles the task """
+    __slots__ = ("payload",)
+
+    def __init__(self, payload: _SharedPayload) -> None:
+        self.payload = payload
+
+    def __reduce__(self):
+        return _load_shared_argument, (self.payload,)
+
+
+def _load_shared_argument(payload: _SharedPayload):
+    return payload.loads()
+
+
+def _message_ids(message: Union[tuple, list]) -> "list[int]":
+    """ the ids of the tasks of an encoded message. """
+    return [m[0] for m in message] if isinstance(message, list) else [message[0]]
+
+
+def _release_shared(message: Union[tuple, list]):
+    """ unlinks the shared memory segments of the arguments of an encoded message that is dropped unread. """
+    for _, _, args, _ in message if isinstance(message, list) else [message]:
+        if type(args) is _SharedPayload and args.segment is not None:
+            try:
+                args.unlink()
+            except FileNotFoundError:  # loaded after all.
+                pass
+
+
+def _message_key(message: Union[tuple, list]) -> int:
+    """ the id of the first task of an encoded message, which identifies the message and its reply. """
+    return message[0][0] if isinstance(message, list) else message[0]
+
+
+def _resolved_by_parent(t: Union[Task, TaskChain]) -> bool:
+    """ True if the result of t is not final, but has to be resolved into the next task of its chain by the parent. """
+    return isinstance(t, TaskChain) and t.next is not None and not t.resolve_in_worker
+
+
+def _function_name(f: Callable) -> str:
+    """ the qualified name of a task's function, for the telemetry. """
+    while isinstance(f, functools.partial):
+        f = f.func
+    return getattr(f, "__qualname__", None) or type(f).__qualname__
+
+
+def _percentile(values: "list[float]", q: float) -> Union[float, None]:
+    """ the q-th percentile of sorted values, linearly interpolated between the closest ranks. """
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def _check_chunksize(chunksize):
+    if chunksize == CHUNKSIZE_AUTO:
+        return
+    if not isinstance(chunksize, int) or chunksize < 1:
+        raise ValueError(f"chunksize must be a positive integer or '{CHUNKSIZE_AUTO}', got {chunksize!r}")
+
+
+def _tqdm():
+    """ the default progress bar, imported on first use: importing mplite stays cheap, in the workers as well. """
+    from tqdm import tqdm
+
+    return tqdm
 
 
 def pickle_exception(e: Exception):
+    import tblib.pickling_support as pklex  # only needed once a task fails.
+
     if e.__traceback__ is not None:
         tback = pklex.pickle_traceback(e.__traceback__)
         e.__traceback__ = None
@@ -334,18 +3362,42 @@ def unpickle_exception(e):
     return fn_ex(ex_cls, ex_txt, ex_rsn, tback, *others)
 
 
-def _do_task_exception_mode(task: Task):
+def _rss() -> Union[int, None]:
+    """ resident memory of the current process in bytes, None if it cannot be measured. """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil  # optional, not a dependency of mplite.
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # the peak, rather than the current memory use.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _raise(error: BaseException):
+    raise error
+
+
+def _do_task_exception_mode(f: Callable, args: tuple, kwargs: dict):
     """ execute task in exception mode"""
     try:
-        return True, task.execute()
+        return True, f(*args, **kwargs)
     except Exception as e:
         return False, pickle_exception(e)
 
 
-def _do_task_str_mode(task: Task):
+def _do_task_str_mode(f: Callable, args: tuple, kwargs: dict):
     """ execute task in legacy string mode """
     try:
-        return True, task.execute()
+        return True, f(*args, **kwargs)
     except Exception:
         f = io.StringIO()
         traceback.print_exc(limit=3, file=f)
@@ -354,3 +3406,26 @@ def _do_task_str_mode(task: Task):
         f.close()
 
         return False, error
+
+
+def _do_task_for(error_mode: str) -> Callable:
+    """ the function that runs a task and catches its exception as error_mode says. """
+    return _do_task_exception_mode if error_mode == ERR_MODE_EXCEPTION else _do_task_str_mode
+
+
+def _context_position(f: Callable) -> int:
+    """
+    position of the `ctx: WorkerContext` parameter of f, a large number if it is keyword only, -1 if f has none.
+    the annotation opts in: a parameter that is only named ctx may mean something else to existing functions.
+    """
+    try:
+        parameters = list(inspect.signature(f).parameters.values())
+    except (TypeError, ValueError):  # e.g. builtins without a signature.
+        return -1
+    for position, parameter in enumerate(parameters):
+        # a string with `from __future__ import annotations`.
+        if parameter.name == "ctx" and parameter.annotation in (WorkerContext, "WorkerContext", "mplite.WorkerContext"):
+            if parameter.kind is parameter.KEYWORD_ONLY:
+                return sys.maxsize
+            return position if parameter.kind is parameter.POSITIONAL_OR_KEYWORD else -1
+    return -1
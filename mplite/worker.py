@@ -0,0 +1,128 @@
+"""
+The worker agent, which runs tasks for a TaskManager on another machine (see listen of TaskManager):
+
+    MPLITE_AUTHKEY=secret python -m mplite.worker --connect host:port --workers 8
+
+Each worker connects to the TaskManager on its own and runs its tasks until the TaskManager stops.
+"""
+import os
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+from multiprocessing import connection
+from mplite import Worker, _LocalQueue, _RemoteProcess
+
+_HANDSHAKE_TIMEOUT = 30.0  # seconds the TaskManager has to authenticate and send the settings, see _connect
+
+
+class _Sender(object):
+    """ the result pipe of a remote worker: results and heartbeats share its connection. """
+    def __init__(self, conn: connection.Connection) -> None:
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def send(self, obj):
+        with self.lock:
+            self.conn.send(obj)
+
+
+def serve(address: tuple, authkey: bytes, wait: float = 0):
+    """
+    connects a worker to the TaskManager listening at address (host, port), and runs its tasks until it stops.
+    retries for up to wait seconds while the TaskManager doesn't listen yet.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            conn, settings = _connect(address, authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+    heartbeat = settings.pop("heartbeat")
+    worker = Worker(multiprocessing.get_context(), backend="remote", **settings)
+    worker.tq, worker.rq = _LocalQueue(), _Sender(conn)
+    stopped = threading.Event()
+    threading.Thread(target=_receive, args=(conn, worker, stopped), name="mplite-receiver", daemon=True).start()
+    threading.Thread(target=_beat, args=(worker.rq, heartbeat, stopped), name="mplite-heartbeat", daemon=True).start()
+    worker.update()
+    stopped.set()
+    conn.close()
+
+
+def _connect(address: tuple, authkey: bytes) -> "tuple[connection.Connection, dict]":
+    """
+    connection.Client, and the settings of the worker: the connection is shut down if the TaskManager
+    doesn't complete the handshake within _HANDSHAKE_TIMEOUT seconds.
+    """
+    sock = socket.create_connection(address)
+    conn = connection.Connection(sock.dup().detach())
+    deadline = threading.Timer(_HANDSHAKE_TIMEOUT, _RemoteProcess(conn, sock).kill)
+    deadline.daemon = True
+    deadline.start()
+    try:  # the handshake of connection.Client, see TaskManager._join
+        connection.answer_challenge(conn, authkey)
+        connection.deliver_challenge(conn, authkey)
+        settings = conn.recv()
+    except BaseException:
+        conn.close()
+        raise
+    finally:
+        deadline.cancel()
+        sock.close()  # conn keeps its own handle.
+    return conn, settings
+
+
+def _receive(conn: connection.Connection, worker: Worker, stopped: threading.Event):
+    """ moves the messages from the connection to the worker's task queue, so that it can read ahead to cancel messages. """
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            if not stopped.is_set():  # the TaskManager is gone or gave up on this worker, its tasks are requeued.
+                os._exit(1)
+            return
+        if message == "stop":
+            stopped.set()
+        worker.tq.put(message)
+        if type(message) is tuple and message[0] in ("cancel", "steal"):
+            worker.status[2] += 1  # see TaskManager._cancel
+
+
+def _beat(sender: _Sender, interval: float, stopped: threading.Event):
+    """ tells the TaskManager that the worker is alive, also while it runs a long task. """
+    while not stopped.wait(interval):
+        try:
+            sender.send("heartbeat")
+        except OSError:
+            return
+
+
+def main(argv: "list[str]" = None):
+    parser = argparse.ArgumentParser(prog="python -m mplite.worker", description="Runs tasks for a TaskManager on another machine.")
+    parser.add_argument("--connect", required=True, metavar="HOST:PORT", help="address the TaskManager listens at.")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="number of worker processes, default: cpu count.")
+    parser.add_argument("--wait", type=float, default=60, help="seconds to wait for the TaskManager to listen, default: 60.")
+    parser.add_argument("--authkey", default=os.environ.get("MPLITE_AUTHKEY"), help="default: the environment variable MPLITE_AUTHKEY.")
+    args = parser.parse_args(argv)
+    if not args.authkey:
+        parser.error("an authkey is required, use --authkey or the environment variable MPLITE_AUTHKEY.")
+    host, _, port = args.connect.rpartition(":")
+    address = (host.strip("[]"), int(port))
+
+    if args.workers == 1:
+        serve(address, args.authkey.encode(), args.wait)
+        return
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=serve, args=(address, args.authkey.encode(), args.wait), name=f"mplite-agent-{i}") for i in range(args.workers)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()
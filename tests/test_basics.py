@@ -1,7 +1,16 @@
 import os
 import platform
 import signal
-from mplite import TaskManager, Task, TaskChain
+import socket
+import multiprocessing
+import subprocess
+import sys
+from mplite import TaskManager, Task, TaskChain, TaskGraph, LRUCache, ResultCache, Serializer, Stats, WorkerContext, as_completed, wait
+import threading
+import asyncio
+import functools
+from concurrent.futures import CancelledError
+import pickle
 import time
 import traceback
 import random
@@ -225,5 +234,808 @@ def test_exception_mode():
             assert type(e.__traceback__).__name__ == "traceback", "not a traceback"
             assert 'in task_exception\n    raise ValueError(f"my exception: {i}")\n' in traceback.format_tb(e.__traceback__)[-1], "wrong callstack"
 
+def test_chunksize():
+    tasks = [Task(adder, i, 1) for i in range(100)]
+    chains = [TaskChain(Task(foo, 1), next_task=chain_step) for _ in range(5)]
+
+    with TaskManager(2, chunksize=7) as tm:
+        assert tm.execute(tasks) == [i + 1 for i in range(100)]
+        assert tm.execute(chains) == [2] * 5
+        assert tm.execute(tasks, chunksize="auto") == [i + 1 for i in range(100)]
+        assert tm.open_tasks == 0
+
+        for i in range(10):  # submit holds tasks back until a chunk is full or take is called.
+            tm.submit(Task(adder, i, 1))
+        results = []
+        while tm.open_tasks > 0:
+            result = tm.take()
+            if result is not None:
+                results.append(result)
+        assert sorted(results) == [i + 1 for i in range(10)]
+
+    try:
+        TaskManager(chunksize=0)
+        assert False, "chunksize must be positive"
+    except ValueError:
+        assert True
+
+
+def chain_step(prev, res):
+    return Task(adder, res, 1)
+
+
+def test_imap():
+    pulled = []
+
+    def lazy_tasks(n):
+        for i in range(n):
+            pulled.append(i)
+            yield Task(adder, i, 1)
+
+    with TaskManager(2) as tm:
+        results = []
+        for result in tm.imap(lazy_tasks(200), max_in_flight=5):
+            results.append(result)
+            assert len(pulled) - len(results) <= 5, "too many tasks in flight"
+        assert results == [i + 1 for i in range(200)]
+
+        results = tm.imap(lazy_tasks(50), ordered=False, chunksize=4)
+        assert sorted(results) == [i + 1 for i in range(50)]
+
+        chains = (TaskChain(Task(foo, i), next_task=chain_step) for i in range(10))
+        assert list(tm.imap(chains)) == [i + 1 for i in range(10)]
+
+        for result in tm.imap(lazy_tasks(100)):
+            break  # stopping early must not leave results behind.
+        assert tm.open_tasks == 0
+        assert tm.execute([Task(adder, 1, 1)]) == [2]
+
+
+def test_futures():
+    with TaskManager(2, error_mode="exception") as tm:
+        tasks = [Task(adder, i, 1) for i in range(20)]
+        futures = [tm.submit(t) for t in tasks]
+        assert [f.task_id for f in futures] == [t.id for t in tasks]
+        assert [f.result(timeout=30) for f in futures] == [i + 1 for i in range(20)]
+        assert all(f.done() for f in futures)
+        assert tm.take() is None, "claimed results must not be returned by take"
+        assert tm.open_tasks == 0
+
+        futures = {tm.submit(Task(adder, i, 1)): i for i in range(10)}
+        assert sorted(f.result() - futures[f] for f in as_completed(futures)) == [1] * 10
+        done, not_done = wait(futures, timeout=30)
+        assert len(done) == 10 and not not_done
+
+        called = threading.Event()
+        future = tm.submit(Task(task_exception, 4))
+        future.add_done_callback(lambda f: called.set())
+        assert isinstance(future.exception(timeout=30), ValueError)
+        assert called.wait(timeout=30)
+
+        # several producers sharing one TaskManager each get their own results.
+        def producer(offset, out):
+            out.extend(f.result() for f in [tm.submit(Task(adder, offset, i)) for i in range(10)])
+
+        outputs = [[] for _ in range(4)]
+        threads = [threading.Thread(target=producer, args=(100 * n, outputs[n])) for n in range(4)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        assert outputs == [[100 * n + i for i in range(10)] for n in range(4)]
+
+        tm.submit(Task(adder, 1, 1))  # unclaimed futures are returned by take.
+        assert tm.take(timeout=None) == 2
+        assert tm.take(timeout=None) is None, "nothing left to wait for"
+
+    with TaskManager(2, chunksize=100) as tm:  # partial chunks are sent without asking for a result.
+        futures = [tm.submit(Task(adder, i, 1)) for i in range(10)]
+        done, not_done = wait(futures, timeout=30)
+        assert len(done) == 10 and not not_done
+        futures = [tm.submit(Task(adder, i, 1)) for i in range(10)]
+        assert sorted(f.result() for f in as_completed(futures, timeout=30)) == [i + 1 for i in range(10)]
+        future = tm.submit(Task(adder, 1, 1))
+        end = time.time() + 30
+        while not future.done():
+            assert time.time() < end, "a polled future must complete"
+            time.sleep(0.01)
+
+
+def test_asyncio():
+    async def main():
+        async with TaskManager(2, error_mode="exception") as tm:
+            assert await tm.run(Task(adder, 1, 2)) == 3
+            assert await tm.run(TaskChain(Task(foo, 1), next_task=chain_step)) == 2
+
+            # the event loop keeps running while tasks execute.
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            ticking = asyncio.ensure_future(ticker())
+            results = await asyncio.gather(*(tm.run(Task(sleeper, 0.2, i)) for i in range(4)))
+            ticking.cancel()
+            assert results == list(range(4))
+            assert ticks > 10, "event loop was blocked"
+
+            results = [r async for r in tm.amap((Task(adder, i, 1) for i in range(30)), max_in_flight=4)]
+            assert results == [i + 1 for i in range(30)]
+
+            async def async_tasks():
+                for i in range(10):
+                    yield Task(adder, i, 1)
+
+            results = [r async for r in tm.amap(async_tasks(), ordered=False)]
+            assert sorted(results) == [i + 1 for i in range(10)]
+
+            try:
+                await tm.run(Task(task_exception, 4))
+                assert False
+            except ValueError:
+                assert True
+            assert tm.open_tasks == 0
+
+    asyncio.run(main())
+
+
+def sleeper(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+def sleeper_with_context(seconds, value, ctx: WorkerContext):
+    time.sleep(seconds)
+    return value, ctx.state, ctx.name
+
+
+class Scaler(object):
+    def __init__(self, factor):
+        self.factor = factor
+
+    def scale(self, x):
+        return x * self.factor
+
+
+def test_function_registry():
+    scale = functools.partial(adder, 1000)
+    with TaskManager(2, function_registry=True) as tm:
+        assert tm.execute([Task(scale, i) for i in range(20)]) == [1000 + i for i in range(20)]
+        assert tm.execute([Task(scale, 1), Task(adder, 1, 1)], chunksize=2) == [1001, 2]
+        assert len(tm._functions) == 2, "each function is registered once"
+
+        # the least recently used functions are dropped, once their tasks are done.
+        partials = [functools.partial(adder, i) for i in range(300)]
+        assert tm.execute([Task(p, 1) for p in partials]) == [i + 1 for i in range(300)]
+        assert len(tm._functions) <= 256 and len(tm._pickled_functions) <= 256
+        assert tm.execute([Task(partials[0], 1), Task(scale, 1)]) == [1, 1001]
+        assert not tm._task_functions and not tm._function_uses
+
+    scaler = Scaler(2)
+    with TaskManager(1) as tm:  # off by default: callables are sent with their current state.
+        assert tm.execute([Task(scaler.scale, 10)]) == [20]
+        scaler.factor = 20
+        assert tm.execute([Task(scaler.scale, 10)]) == [200]
+
+    with TaskManager(2, function_registry=True) as tm:  # functions registered earlier are sent to new workers on start.
+        tm._function_id(scale)
+        assert tm.execute([Task(scale, 1)]) == [1001]
+
+        try:
+            tm.submit(Task(lambda: 1))  # spawned workers cannot unpickle a lambda.
+            assert False, "unpicklable functions must fail on submit"
+        except (pickle.PicklingError, AttributeError):
+            assert True
+        assert tm.execute([Task(adder, 1, 1)]) == [2]
+
+
+def reverse_payload(payload, extra=None):
+    return {"data": payload[::-1], "extra": extra}
+
+
+def shared_memory_segments():
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")} if os.path.isdir("/dev/shm") else set()
+
+
+def test_shared_memory_transport():
+    before = shared_memory_segments()
+    payload = bytes(range(256)) * 40_000  # ~10 MB
+    with TaskManager(2, shared_memory_threshold=1024) as tm:
+        results = tm.execute([Task(reverse_payload, payload, extra=bytearray(b"small")) for _ in range(3)])
+        assert all(r == {"data": payload[::-1], "extra": bytearray(b"small")} for r in results)
+        assert tm.execute([Task(adder, 1, 1)]) == [2], "small payloads are pickled as usual"
+
+        future = tm.submit(Task(reverse_payload, [payload]))
+        assert future.result()["data"] == [payload]
+    assert shared_memory_segments() == before, "segments must be unlinked"
+
+    try:
+        TaskManager(shared_memory_threshold=0)
+        assert False, "threshold must be positive"
+    except ValueError:
+        assert True
+
+
+def count_down(prev, res):
+    if res == 0:
+        return Task(foo, "done")
+    return TaskChain(Task(adder, res, -1), next_task=count_down)
+
+
+def broken_step(prev, res):
+    raise ValueError("next_task failed")
+
+
+def test_task_chain_resolve_in_worker():
+    chains = [TaskChain(Task(foo, 4), next_task=count_down, resolve_in_worker=True) for _ in range(5)]
+    with TaskManager(2, error_mode="exception") as tm:
+        assert tm.execute(chains) == ["done"] * 5
+        assert list(tm.imap(TaskChain(Task(foo, i), next_task=count_down, resolve_in_worker=True) for i in range(3))) == ["done"] * 3
+        assert tm.submit(TaskChain(Task(foo, 2), next_task=count_down, resolve_in_worker=True)).result() == "done"
+        assert asyncio.run(tm.run(TaskChain(Task(foo, 1), next_task=count_down, resolve_in_worker=True))) == "done"
+
+        try:
+            tm.submit(TaskChain(Task(foo, 1), next_task=count_down))
+            assert False, "chains resolved by the parent cannot be submitted"
+        except TypeError:
+            assert True
+
+        for chain in [TaskChain(Task(task_exception, 4), next_task=count_down, resolve_in_worker=True),
+                      TaskChain(Task(foo, 4), next_task=broken_step, resolve_in_worker=True)]:
+            try:
+                tm.execute([chain])
+                assert False
+            except ValueError:
+                assert True
+
+
+def total(values, offset=0):
+    return sum(values) + offset
+
+
+def test_task_graph():
+    g = TaskGraph()
+    parts = [g.add(Task(adder, i, i)) for i in range(10)]  # fan-out
+    summed = g.add(Task(total, parts, offset=g.add(Task(foo, 100))))  # fan-in, also through kwargs.
+    last = g.add(Task(foo, "last"), after=[summed])
+    kept = g.add(Task(reverse_payload, bytes(range(256)) * 4_000), keep_in_worker=True)
+    consumer = g.add(Task(foo, {"payload": kept}))
+
+    try:
+        g.add(Task(foo, Task(foo, 1)))
+        assert False, "dependencies must be added first"
+    except ValueError:
+        assert True
+    try:
+        g.add(last)
+        assert False, "tasks can only be added once"
+    except ValueError:
+        assert True
+
+    before = shared_memory_segments()
+    with TaskManager(2, error_mode="exception") as tm:
+        results = tm.execute_graph(g)
+        assert results[:10] == [2 * i for i in range(10)]
+        assert results[10] == 100 and results[11] == 190 and results[12] == "last"
+        if os.name != "nt":  # keep_in_worker is ignored on Windows, where the kept result is returned.
+            assert results[13] is None, "kept results are not returned"
+        assert results[14] == {"payload": {"data": (bytes(range(256)) * 4_000)[::-1], "extra": None}}
+
+        failing = TaskGraph()
+        failing.add(Task(total, [failing.add(Task(task_exception, 4))]))
+        try:
+            tm.execute_graph(failing)
+            assert False
+        except ValueError:
+            assert True
+    assert shared_memory_segments() == before, "kept segments must be unlinked"
+
+
+def crash_once(marker, value):
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(9)
+    return value
+
+
+def test_worker_respawn(tmp_path):
+    with TaskManager(2, max_retries=1) as tm:
+        tasks = [Task(adder, i, 1) for i in range(20)]
+        tasks.insert(10, Task(crash_once, str(tmp_path / "crashed"), "recovered"))
+        results = tm.execute(tasks)
+        assert results[10] == "recovered"
+        assert results[:10] + results[11:] == [i + 1 for i in range(20)]
+        assert len(tm.pool) == 2 and all(p.is_alive() for p in tm.pool)
+
+    with TaskManager(2) as tm:  # max_retries=0: the task fails, the other tasks don't.
+        futures = [tm.submit(Task(adder, i, 1)) for i in range(5)]
+        crashed = tm.submit(Task(crash_once, str(tmp_path / "crashed again"), "recovered"))
+        futures += [tm.submit(Task(adder, i, 1)) for i in range(5, 10)]
+        assert isinstance(crashed.exception(), ChildProcessError)
+        assert [f.result() for f in futures] == [i + 1 for i in range(10)]
+        assert tm.open_tasks == 0
+        assert tm.execute([Task(adder, 1, 1)]) == [2]
+
+
+def test_task_timeout():
+    with TaskManager(2) as tm:
+        start = time.perf_counter()
+        tasks = [Task(adder, i, 1) for i in range(10)]
+        tasks.insert(3, Task(time.sleep, 60).with_timeout(0.5))
+        results = tm.execute(tasks, chunksize=4)
+        assert time.perf_counter() - start < 30
+        assert "TimeoutError" in results[3]
+        assert results[:3] + results[4:] == [i + 1 for i in range(10)]
+        assert len(tm.pool) == 2
+
+    with TaskManager(2, error_mode="exception", task_timeout=0.5) as tm:
+        hung = tm.submit(Task(time.sleep, 60))
+        patient = tm.submit(Task(time.sleep, 60).with_timeout(3))  # a task's own timeout wins.
+        assert isinstance(hung.exception(), TimeoutError)
+        assert not patient.done()
+
+    try:
+        Task(adder, 1, 2).with_timeout(0)
+        assert False, "timeouts must be positive"
+    except ValueError:
+        assert True
+
+
+def test_worker_recycling():
+    with TaskManager(2, max_tasks_per_worker=3) as tm:
+        pids = tm.execute([Task(os.getpid) for _ in range(20)])
+        assert max(pids.count(pid) for pid in set(pids)) <= 3
+        assert len(set(pids)) >= 7
+        assert len(tm.pool) == 2
+
+    try:
+        tm = TaskManager(1, max_worker_rss=1)  # every worker exceeds the limit after its first task.
+    except ImportError:  # Windows without psutil, which is optional.
+        tm = None
+    if tm is not None:
+        with tm:
+            assert len(set(tm.execute([Task(os.getpid) for _ in range(3)]))) == 3
+
+    try:
+        TaskManager(max_tasks_per_worker=0)
+        assert False, "limits must be positive"
+    except ValueError:
+        assert True
+
+
+def test_cancel():
+    with TaskManager(1, error_mode="exception") as tm:
+        start = time.perf_counter()
+        try:
+            tm.execute([Task(task_exception, 4)] + [Task(time.sleep, 1) for _ in range(10)])
+            assert False
+        except ValueError:
+            assert True
+        assert tm.execute([Task(adder, 1, 1)]) == [2], "no stale results"
+        assert time.perf_counter() - start < 5, "the tasks after the failure must be dropped"
+
+        running = tm.submit(Task(time.sleep, 0.5))
+        queued = tm.submit(Task(adder, 1, 2))
+        assert queued.cancel()
+        try:
+            queued.result()
+            assert False
+        except CancelledError:
+            assert True
+        assert running.result() is None
+        assert not running.cancel(), "finished tasks cannot be cancelled"
+        assert tm.open_tasks == 0
+
+    with TaskManager(1, interrupt_running=True) as tm:
+        start = time.perf_counter()
+        hung = tm.submit(Task(time.sleep, 60))
+        time.sleep(0.5)
+        assert tm.cancel(hung.task_id)
+        assert tm.execute([Task(adder, 1, 1)]) == [2]
+        assert time.perf_counter() - start < 30, "the running task must be interrupted"
+
+    before = shared_memory_segments()
+    with TaskManager(1, shared_memory_threshold=1024, error_mode="exception") as tm:
+        try:
+            tm.execute([Task(task_exception, 4)] + [Task(reverse_payload, b"x" * 100_000) for _ in range(20)])
+            assert False
+        except ValueError:
+            assert True
+        assert tm.execute([Task(adder, 1, 1)]) == [2]
+        assert shared_memory_segments() == before, "dropped tasks must unlink their segments"
+
+
+def test_priority():
+    with TaskManager(1, priority_aging=0) as tm:
+        tasks = [Task(time.monotonic_ns).with_priority(i % 3) for i in range(9)]
+        stamps = tm.execute(tasks)
+        assert [tasks[i].priority for i in sorted(range(9), key=stamps.__getitem__)] == [2, 2, 2, 1, 1, 1, 0, 0, 0]
+
+    for aging, high_first in [(0, True), (1000, False)]:  # aging: waiting 0.1 s is worth 100 priority levels.
+        with TaskManager(1, priority_aging=aging) as tm:
+            busy = [tm.submit(Task(time.sleep, 0.3)) for _ in range(2)]  # fills the worker's queue.
+            low = tm.submit(Task(time.monotonic_ns))
+            time.sleep(0.1)
+            high = tm.submit(Task(time.monotonic_ns).with_priority(10))
+            assert (high.result() < low.result()) == high_first
+            wait(busy)
+
+
+def test_work_stealing():
+    durations = [1.0, 0.01, 0.5, 0.01]  # the 0.5 s task is queued behind the 1 s task.
+    for work_stealing in [False, True]:
+        with TaskManager(2, work_stealing=work_stealing) as tm:
+            tm.execute([Task(sleeper, 0.1, i) for i in range(2)])  # one for each worker, once they have started.
+            results = tm.execute([Task(sleeper_with_context, d, i) for i, d in enumerate(durations)])
+            assert [value for value, _, _ in results] == [0, 1, 2, 3]
+            names = [name for _, _, name in results]
+            # the idle worker takes the 0.5 s task over, instead of waiting for the 1 s task to end.
+            assert (names[2] != names[0]) == work_stealing, names
+
+    with TaskManager(2, work_stealing=True) as tm:  # chunks of tasks of random durations.
+        durations = [random.choice([0.0, 0.0, 0.0, 0.05]) for _ in range(200)]
+        assert tm.execute([Task(sleeper, d, i) for i, d in enumerate(durations)], chunksize=5) == list(range(200))
+        futures = [tm.submit(Task(sleeper, d, i)) for i, d in enumerate(durations)]
+        assert [f.result() for f in futures] == list(range(200))
+
+
+def test_affinity():
+    with TaskManager(3) as tm:
+        pids = {}
+        for i in range(30):  # one at a time, so that the preferred worker always has room.
+            key = i % 5
+            pids.setdefault(key, set()).add(tm.submit(Task(os.getpid).with_affinity(key)).result())
+        assert all(len(p) == 1 for p in pids.values()), pids
+
+        # a worker with nothing to do takes over tasks waiting for another worker.
+        results = tm.execute([Task(sleeper_with_context, 0.1, i).with_affinity("hot") for i in range(12)])
+        assert [value for value, _, _ in results] == list(range(12))
+        assert len({name for _, _, name in results}) > 1, results
+
+
+def load_settings(offset, ctx: WorkerContext):
+    ctx.cache.put("loads", 0)
+    return {"offset": offset}
+
+
+def lookup_with_context(key, ctx: WorkerContext):
+    def load():
+        ctx.cache.put("loads", ctx.cache.get("loads") + 1)
+        return key * 10
+    return ctx.cache.get_or_compute(("value", key), load) + ctx.state["offset"], ctx.cache.get("loads"), ctx.name
+
+
+def render(template, ctx=None):
+    return template, ctx
+
+
+def test_worker_context():
+    with TaskManager(1, worker_init=Task(load_settings, 5)) as tm:
+        results = tm.execute([Task(lookup_with_context, key) for key in [1, 2, 1, 1, 2]])
+        assert [value for value, _, _ in results] == [15, 25, 15, 15, 25]
+        assert [loads for _, loads, _ in results] == [1, 2, 2, 2, 2]  # each key is loaded once per worker.
+        assert {name for _, _, name in results} == {"0"}
+        assert tm.submit(Task(adder, 1, 2)).result() == 3  # functions without ctx are unaffected.
+        assert tm.submit(Task(render, "a")).result() == ("a", None)  # a ctx without the annotation is left alone.
+
+    cache = LRUCache(max_size=100)
+    cache.put("a", b"", size=40)
+    cache.put("b", b"", size=40)
+    assert cache.get("a") == b""  # "b" is now the least recently used.
+    cache.put("c", b"", size=40)
+    assert "b" not in cache and "a" in cache and "c" in cache and cache.size == 80
+    cache.put("huge", b"", size=101)
+    assert "huge" not in cache and len(cache) == 2
+
+
+def stamp(value):
+    time.sleep(0.05)
+    return value, time.monotonic_ns()  # differs between runs.
+
+
+def fail_once(marker):
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        raise ValueError("first run")
+    return "ok"
+
+
+def test_result_cache(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    with TaskManager(2, result_cache=ResultCache(path=path)) as tm:
+        first = tm.execute([Task(stamp, 1), Task(stamp, 1), Task(stamp, 2), Task(stamp, value=1)])
+        assert first[0] == first[1]  # identical tasks in flight run once.
+        assert len({first[0], first[2], first[3]}) == 3  # keyword arguments count.
+        assert tm.execute([Task(stamp, 2), Task(stamp, 1)]) == [first[2], first[0]]
+        assert list(tm.imap([Task(stamp, 1)])) == [first[0]]
+        assert tm.submit(Task(stamp, 2)).result() == first[2]
+        marker = str(tmp_path / "failed")
+        assert "ValueError" in tm.execute([Task(fail_once, marker)])[0]
+        assert tm.execute([Task(fail_once, marker)]) == ["ok"]  # failed tasks are not cached.
+        tm.result_cache.close()
+
+    cache = ResultCache(path=path)  # the results on disk outlast the TaskManager.
+    with TaskManager(1, result_cache=cache) as tm:
+        assert tm.execute([Task(stamp, 1)]) == [first[0]]
+    assert cache.get(ResultCache.key(Task(stamp, 2))) == (True, first[2])
+
+    def make(n):
+        def inner(x):
+            return x + n
+        return inner
+
+    with TaskManager(1, backend="thread", result_cache=True) as tm:  # lambdas and closures of the same name differ.
+        assert tm.execute([Task(lambda x: x + 1, 3)]) == [4]
+        assert tm.execute([Task(lambda x: x * 100, 3)]) == [300]
+        assert tm.execute([Task(make(1), 3), Task(make(2), 3)]) == [4, 5]
+        assert tm.execute([Task(make(2), 3)]) == [5]
+
+    caches = [ResultCache(max_size=1000, path=path, max_disk_size=1000) for _ in range(2)]  # as in two processes.
+    for i in range(100):
+        caches[i % 2].put(ResultCache.key(Task(stamp, i)), bytes(100))
+    assert caches[0].memory.size <= 1000
+    assert caches[0]._db.execute("SELECT SUM(size) FROM results").fetchone()[0] <= 1000
+    assert caches[0].get(ResultCache.key(Task(stamp, 99)))[0] and not caches[0].get(ResultCache.key(Task(stamp, 0)))[0]
+    for cache in caches:
+        cache.close()
+
+
+def test_serializer():
+    text = "mplite " * 100_000
+    serializer = Serializer(compression="zlib")
+    assert len(serializer.dumps(text)) < len(text) // 100
+    assert serializer.loads(serializer.dumps(text)) == text
+
+    with TaskManager(1, serializer=Serializer()) as tm:  # plain pickle can't send lambdas.
+        try:
+            tm.execute([Task(lambda: 1)])
+            assert False, "lambda was pickled"
+        except (pickle.PicklingError, AttributeError):
+            pass
+
+    try:
+        import cloudpickle  # noqa: F401
+    except ImportError:  # an optional dependency.
+        return
+    serializer = Serializer(cloudpickle=True, compression="zlib")
+    offset = 10
+    for registry in [True, False]:
+        with TaskManager(1, serializer=serializer, function_registry=registry) as tm:
+            assert tm.execute([Task(lambda x: x + offset, i) for i in range(3)]) == [10, 11, 12]
+            assert tm.submit(Task(str.upper, text)).result() == text.upper()
+            assert tm.execute([TaskChain(Task(lambda: 1), lambda prev, res: Task(lambda r: r + 1, res), resolve_in_worker=True)]) == [2]
+            assert "ZeroDivisionError" in tm.execute([Task(lambda: 1 / 0)])[0]
+
+
+def test_backends():
+    for backend in ["process", "thread", "inline"]:
+        with TaskManager(2, backend=backend) as tm:
+            assert tm.execute([Task(adder, i, 1) for i in range(10)], chunksize=3) == list(range(1, 11))
+            assert "ValueError" in tm.execute([Task(task_exception, 4)])[0]
+            chain = TaskChain(Task(adder, 1, 2), next_task=chain_step)
+            assert tm.execute([chain]) == [4]
+            assert list(tm.imap((Task(adder, i, i) for i in range(5)), ordered=True)) == [0, 2, 4, 6, 8]
+            futures = [tm.submit(Task(adder, i, 0)) for i in range(4)]
+            assert sorted(tm.take(timeout=5) for _ in futures) == [0, 1, 2, 3]
+            if backend != "process":  # no pickling.
+                assert tm.submit(Task(lambda: threading.get_ident())).result() != 0
+        with TaskManager(2, backend=backend, error_mode="exception") as tm:
+            try:
+                tm.execute([Task(task_exception, 4)])
+                assert False
+            except ValueError as e:
+                assert str(e) == "my exception: 4"
+
+    with TaskManager(backend="inline") as tm:  # runs in the calling thread, for debuggers and profilers.
+        assert tm.execute([Task(threading.get_ident)]) == [threading.get_ident()]
+    try:
+        TaskManager(backend="thread", task_timeout=1)
+        assert False
+    except ValueError:
+        pass
+
+
+def slow_init(seconds):
+    time.sleep(seconds)
+    return "ready"
+
+
+def test_autoscaling():
+    for backend in ["process", "thread"]:
+        with TaskManager(min_workers=1, max_workers=4, idle_timeout=0.5, backend=backend, worker_init=Task(slow_init, 0.2)) as tm:
+            assert len(tm.pool) == 1
+            futures = [tm.submit(Task(sleeper_with_context, 0.1, i)) for i in range(40)]
+            sizes = []
+            while not all(f.done() for f in futures):
+                sizes.append(len(tm.pool))
+                time.sleep(0.02)
+            results = [f.result() for f in futures]
+            assert [value for value, _, _ in results] == list(range(40))
+            assert all(state == "ready" for _, state, _ in results)  # new workers take tasks after worker_init.
+            assert max(sizes) == 4 and len({name for _, _, name in results}) > 1
+
+            time.sleep(1.5)  # idle workers stop, down to min_workers.
+            assert len(tm.pool) == 1
+            assert tm.execute([Task(adder, 1, 2)]) == [3]
+
+    with TaskManager(min_workers=0, max_workers=2) as tm:  # the pool starts empty, and grows with the first tasks.
+        assert len(tm.pool) == 0
+        assert tm.execute([Task(adder, i, 1) for i in range(10)], chunksize="auto") == list(range(1, 11))
+        graph = TaskGraph()
+        graph.add(Task(adder, graph.add(Task(adder, 1, 1)), 1))
+        assert tm.execute_graph(graph) == [2, 3]
+        assert list(tm.imap([Task(adder, i, 1) for i in range(10)])) == list(range(1, 11))
+
+    for kwargs in [dict(min_workers=2), dict(min_workers=3, max_workers=2), dict(max_workers=2, backend="inline")]:
+        try:
+            TaskManager(**kwargs)
+            assert False, kwargs
+        except ValueError:
+            pass
+
+
+def test_start():
+    # workers are ready once start returns: they ran worker_init.
+    start = time.perf_counter()
+    with TaskManager(3, worker_init=Task(slow_init, 0.3)) as tm:
+        assert time.perf_counter() - start > 0.3
+        assert len(tm.pool) == 3
+        results = tm.execute([Task(sleeper_with_context, 0, i) for i in range(30)])
+        assert [(value, state) for value, state, _ in results] == [(i, "ready") for i in range(30)]
+
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        with TaskManager(2, context="forkserver", preload=["json"]) as tm:
+            assert tm.execute([Task(adder, 1, 2)]) == [3]
+    try:
+        TaskManager(2, context="spawn", preload=["json"])
+        assert False
+    except ValueError:
+        pass
+
+    # importing mplite doesn't import the progress bar and the traceback pickler, until they are used.
+    code = "import sys, mplite; assert not {'tqdm', 'tblib', 'asyncio'} & set(sys.modules), sorted(sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).returncode == 0
+
+
+def test_telemetry():
+    with TaskManager(2) as tm:
+        assert tm.stats is None  # off by default.
+
+    for backend in ["process", "thread", "inline"]:
+        with TaskManager(2, telemetry=True, backend=backend) as tm:
+            tm.execute([Task(sleeper, 0.02, b"x" * 10_000) for _ in range(10)])
+            tm.execute([Task(adder, i, 1) for i in range(100)], chunksize=10)
+            stats = tm.stats
+            assert len(stats.tasks) == 110 and not stats.open
+            for t in stats.tasks:
+                assert t.enqueued <= t.sent <= t.started <= t.ended <= t.received
+            summary = stats.summary()
+            assert summary["execution"]["count"] == 110
+            assert 0.02 <= summary["execution"]["max"] < 1
+            assert summary["execution"]["p50"] <= summary["execution"]["p90"] <= summary["execution"]["p99"] <= summary["execution"]["max"]
+            assert stats.percentile("total", 100) == summary["total"]["max"]
+            if backend == "process":  # the large results are measured, the small chunks are shared among their tasks.
+                assert stats.percentile("received_bytes", 0) < 100 < 10_000 < stats.percentile("received_bytes", 100)
+            else:
+                assert "sent_bytes" not in summary
+            workers = stats.workers()
+            assert sum(w["tasks"] for w in workers.values()) == 110
+            assert all(0 < w["utilization"] <= 1 for w in workers.values())
+            assert "utilization" in str(stats)
+            stats.clear()
+            assert not stats.tasks
+
+    stats = Stats(max_tasks=5)
+    with TaskManager(1, telemetry=stats) as tm:
+        tm.execute([Task(adder, i, 1) for i in range(20)])
+        assert tm.stats is stats and len(stats.tasks) == 5
+
+
+def test_trace(tmp_path):
+    import json
+
+    for backend in ["process", "thread", "inline"]:
+        path = tmp_path / f"{backend}.json"
+        with TaskManager(2, worker_init=Task(slow_init, 0.05), trace=str(path), backend=backend) as tm:
+            assert tm.stats is not None  # a trace records telemetry.
+            tm.execute([Task(sleeper, 0.01 * (i % 3), i) for i in range(10)])
+            tm.execute([TaskChain(Task(foo, 1), next_task=chain_step) for _ in range(3)])
+        events = json.loads(path.read_text())["traceEvents"]
+
+        workers = 1 if backend == "inline" else 2
+        tracks = {e["tid"]: e["args"]["name"] for e in events if e["name"] == "thread_name"}
+        assert len(tracks) == workers and all(name.startswith("worker ") for name in tracks.values())
+        spans = [e for e in events if e["ph"] == "X"]
+        assert sum(e["name"] == "worker_init" and e["dur"] >= 50_000 for e in spans) == workers
+        assert sum(e["name"] == "sleeper" for e in spans) == 10
+        assert sum(e["name"] == "foo" for e in spans) == sum(e["name"] == "adder" for e in spans) == 3  # the steps of the chains.
+        assert any(e["name"] == "idle" for e in spans)
+        for tid in tracks:  # the spans of a track follow each other.
+            track = sorted((e["ts"], e["ts"] + e["dur"]) for e in spans if e["tid"] == tid)
+            assert all(end <= start + 0.01 for (_, end), (start, _) in zip(track, track[1:]))
+        flows = [e for e in events if e["name"] == "TaskChain"]
+        assert sorted(e["ph"] for e in flows) == ["f", "f", "f", "s", "s", "s"]
+        counters = [e["args"] for e in events if e["ph"] == "C"]
+        assert counters[-1] == {"waiting": 0, "in workers": 0} and max(c["waiting"] for c in counters) > 0
+
+
+def hang(pid, seconds, value):
+    """ freezes the process pid for seconds, heartbeats included: no other thread gets the GIL. """
+    if os.getpid() == pid:
+        sys.setswitchinterval(seconds)
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+    return value
+
+
+def start_agents(address, count, authkey="secret"):
+    """ worker agents for a TaskManager listening at address, as on other machines. """
+    env = dict(os.environ, MPLITE_AUTHKEY=authkey)
+    command = [sys.executable, "-m", "mplite.worker", "--connect", f"{address[0]}:{address[1]}", "--workers", "1", "--wait", "0"]
+    return [subprocess.Popen(command, env=env, stderr=subprocess.DEVNULL) for _ in range(count)]
+
+
+def wait_for_pool(tm, size, timeout=30):
+    end = time.time() + timeout
+    while len(tm.pool) != size:
+        assert time.time() < end, f"{len(tm.pool)} workers, expected {size}"
+        time.sleep(0.05)
+
+
+def test_remote_workers():
+    with TaskManager(cpu_count=0, listen=("127.0.0.1", 0), authkey="secret", max_retries=1, heartbeat_timeout=1) as tm:
+        agents = start_agents(tm.address, 3)
+        try:
+            wait_for_pool(tm, 3)
+            assert tm.execute([Task(adder, i, 1) for i in range(100)]) == list(range(1, 101))
+            assert "ValueError" in tm.execute([Task(task_exception, 4)])[0]
+
+            # the windows of in-flight tasks follow the remote workers, as cpu_count is 0.
+            assert tm.execute([Task(adder, i, 1) for i in range(20)], chunksize="auto") == list(range(1, 21))
+            assert list(tm.imap(Task(adder, i, 1) for i in range(20))) == list(range(1, 21))
+            graph = TaskGraph()
+            for i in range(12):
+                graph.add(Task(sleeper_with_context, 0.3, i))
+            results = tm.execute_graph(graph)
+            assert [value for value, _, _ in results] == list(range(12))
+            assert len({name for _, _, name in results}) == 3, "all 3 nodes must be kept busy"
+
+            # a node that dies: its tasks go to the other nodes.
+            futures = [tm.submit(Task(sleeper, 0.2, i)) for i in range(12)]
+            time.sleep(0.3)
+            agents[0].kill()
+            assert [f.result(timeout=30) for f in futures] == list(range(12))
+            wait_for_pool(tm, 2)
+
+            # a node that hangs: it misses its heartbeats, and its tasks go to the other node.
+            futures = [tm.submit(Task(sleeper, 0.2, i) if i % 3 else Task(hang, agents[1].pid, 30, i)) for i in range(12)]
+            assert [f.result(timeout=30) for f in futures] == list(range(12))
+            wait_for_pool(tm, 1)
+            agents[1].kill()
+
+            # a node with the wrong key isn't let in.
+            intruder = start_agents(tm.address, 1, authkey="wrong")[0]
+            assert intruder.wait(timeout=30) != 0
+            assert len(tm.pool) == 1
+
+            # a client that connects and says nothing is disconnected after heartbeat_timeout.
+            silent = socket.create_connection(tm.address, timeout=30)
+            while silent.recv(1024):  # the challenge, then the end of the connection.
+                pass
+            silent.close()
+        finally:
+            for agent in agents[:2]:
+                agent.kill()
+
+    assert agents[2].wait(timeout=30) == 0  # the remaining node stops with the TaskManager.
+    try:
+        TaskManager(listen=("127.0.0.1", 0), backend="thread", authkey="secret")
+        assert False
+    except ValueError:
+        pass
+
+
 if __name__ == "__main__":
     test_task_order()
\ No newline at end of file
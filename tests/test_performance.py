@@ -1,6 +1,11 @@
+import functools
 import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
 import time
-from mplite import TaskManager, Task
+from mplite import TaskManager, Task, TaskChain
 
 
 def run_calcs_calls(mp_enabled=True, rng=50_000_000, calls=20, cpus=1):
@@ -120,3 +125,192 @@ def test_mplite_performance():
 
 
 
+
+
+def echo(value):
+    return value
+
+
+def test_round_trip_latency():
+    # a single worker serving tiny tasks one at a time: the time measured is
+    # dominated by how fast the worker and the parent notice a new task/result.
+    rounds = 500
+    with TaskManager(1) as tm:
+        tm.submit(Task(echo, 0))
+        while tm.take() is None:
+            pass  # warm up the worker before measuring.
+
+        start = time.perf_counter()
+        for i in range(1, rounds + 1):
+            tm.submit(Task(echo, i))
+            while tm.take() is None:
+                pass
+        end = time.perf_counter()
+
+    latency = (end - start) / rounds
+    print(f'round trip latency per task: {latency * 1e6:.1f} us')
+    assert latency < 0.005, latency  # sleep based polling was 10 ms
+
+
+def test_chunksize_performance():
+    # many tiny tasks: sending them one by one is dominated by the per message overhead.
+    tasks = [Task(fun, *(call, 50)) for call in range(1, 20_001)]
+    timings = {}
+    with TaskManager(cpu_count=multiprocessing.cpu_count()) as tm:
+        for chunksize in [1, "auto"]:
+            start = time.perf_counter()
+            L = tm.execute(tasks, chunksize=chunksize)
+            timings[chunksize] = time.perf_counter() - start
+            assert [t for t, _ in L] == [49 / call for call in range(1, 20_001)]
+            print(f'chunksize: {chunksize}, total time taken: {timings[chunksize]}')
+
+    assert timings["auto"] < timings[1], timings
+
+
+def lookup(table, key):
+    return table[key % len(table)]
+
+
+def test_function_registry_performance():
+    # a partial carrying a large object: without the registry it is pickled with every task.
+    table = list(range(10_000))
+    f = functools.partial(lookup, table)
+    tasks = [Task(f, i) for i in range(2000)]
+    timings = {}
+    for registry in [False, True]:
+        with TaskManager(cpu_count=multiprocessing.cpu_count(), function_registry=registry) as tm:
+            tm.execute(tasks[:1])  # warm up, also registers the function.
+            bytes_per_task = len(pickle.dumps(tm._encode(tasks[0])))
+            start = time.perf_counter()
+            L = tm.execute(tasks)
+            timings[registry] = time.perf_counter() - start
+            assert L == [i % 10_000 for i in range(2000)]
+        print(f'function registry: {registry}, bytes per task: {bytes_per_task}, tasks per second: {len(tasks) / timings[registry]:.0f}')
+
+    assert timings[True] < timings[False], timings
+
+
+def passthrough(payload):
+    return payload
+
+
+def test_shared_memory_performance():
+    payload = bytearray(64 * 1024 * 1024)
+    timings = {}
+    for threshold in [None, 1024 * 1024]:
+        with TaskManager(cpu_count=1, shared_memory_threshold=threshold) as tm:
+            start = time.perf_counter()
+            for _ in range(5):
+                assert len(tm.submit(Task(passthrough, payload)).result()) == len(payload)
+            timings[threshold] = time.perf_counter() - start
+        print(f'shared memory threshold: {threshold}, 64 MB round trip: {timings[threshold] / 5:.3f} s')
+
+    assert timings[1024 * 1024] < timings[None], timings
+
+
+def step(prev, res):
+    if res >= 5:
+        return Task(echo, res)
+    return TaskChain(Task(echo, res + 1), next_task=step)  # a worker resolves the rest of the chain itself.
+
+
+def test_task_chain_performance():
+    # five step chains: resolved by the parent, every step is a round trip through the queues.
+    timings = {}
+    with TaskManager(cpu_count=multiprocessing.cpu_count()) as tm:
+        for in_worker in [False, True]:
+            chains = [TaskChain(Task(echo, 1), next_task=step, resolve_in_worker=in_worker) for _ in range(500)]
+            start = time.perf_counter()
+            assert tm.execute(chains) == [5] * 500
+            timings[in_worker] = time.perf_counter() - start
+            print(f'resolve in worker: {in_worker}, total time taken: {timings[in_worker]}')
+
+    assert timings[True] < timings[False], timings
+
+
+def test_backend_performance():
+    # tiny tasks: the thread and inline backends skip the pickling and the pipes of the process backend.
+    tasks = [Task(fun, *(call, 50)) for call in range(1, 10_001)]
+    timings = {}
+    for backend in ["process", "thread", "inline"]:
+        with TaskManager(cpu_count=1, backend=backend) as tm:
+            start = time.perf_counter()
+            L = tm.execute(tasks)
+            timings[backend] = time.perf_counter() - start
+            assert [t for t, _ in L] == [49 / call for call in range(1, 10_001)]
+        print(f'backend: {backend}, tasks per second: {len(tasks) / timings[backend]:.0f}')
+
+    assert timings["inline"] < timings["process"], timings
+
+
+def test_work_stealing_performance():
+    # tasks of uneven durations: without stealing, the short tasks queued behind a long one wait for it.
+    tasks = [Task(wait_io, d) for d in [1.0, 0.01, 0.5, 0.01] * 2]
+    timings = {}
+    for work_stealing in [False, True]:
+        with TaskManager(cpu_count=2, work_stealing=work_stealing) as tm:
+            tm.execute([Task(wait_io, 0.1) for _ in range(2)])  # one for each worker, once they have started.
+            start = time.perf_counter()
+            tm.execute(tasks)
+            timings[work_stealing] = time.perf_counter() - start
+        print(f'work stealing: {work_stealing}, total time taken: {timings[work_stealing]:.2f}')
+
+    assert timings[True] < timings[False], timings
+
+
+def wait_io(seconds):
+    time.sleep(seconds)  # stands in for the tasks of a node: it runs them without a core of this machine.
+    return seconds
+
+
+def test_remote_worker_performance():
+    tasks = [Task(wait_io, 0.05) for _ in range(80)]
+    with TaskManager(cpu_count=1) as tm:
+        start = time.perf_counter()
+        tm.execute(tasks)
+        local = time.perf_counter() - start
+
+    with TaskManager(cpu_count=1, listen=("127.0.0.1", 0), authkey="secret") as tm:
+        host, port = tm.address
+        command = [sys.executable, "-m", "mplite.worker", "--connect", f"{host}:{port}", "--workers", "1"]
+        agents = [subprocess.Popen(command, env=dict(os.environ, MPLITE_AUTHKEY="secret")) for _ in range(3)]
+        while len(tm.pool) < 4:
+            time.sleep(0.05)
+        start = time.perf_counter()
+        tm.execute(tasks)
+        remote = time.perf_counter() - start
+    for agent in agents:
+        agent.wait(timeout=30)
+
+    print(f"1 local worker: {local:.2f}s, with 3 remote workers: {remote:.2f}s")
+    assert remote < local / 2, (local, remote)
+
+
+def test_startup_performance():
+    # time to the first results of a new pool: the workers are ready when start returns.
+    timings = {}
+    for method in [m for m in ["spawn", "forkserver"] if m in multiprocessing.get_all_start_methods()]:
+        start = time.perf_counter()
+        for _ in range(3):
+            with TaskManager(cpu_count=4, context=method) as tm:
+                tm.execute([Task(fun, 1, 10) for _ in range(4)])
+        timings[method] = (time.perf_counter() - start) / 3
+        print(f"{method}: {timings[method]:.3f}s to start 4 workers and run their first tasks")
+
+    if "forkserver" in timings:
+        assert timings["forkserver"] < timings["spawn"], timings
+
+
+def test_telemetry_performance():
+    # telemetry off must not slow down tiny tasks, on it pickles the tasks in the calling thread instead of the queue's.
+    tasks = [Task(fun, *(call, 50)) for call in range(1, 10_001)]
+    timings = {}
+    for telemetry in [False, True, False, True]:
+        with TaskManager(cpu_count=1, telemetry=telemetry) as tm:
+            start = time.perf_counter()
+            tm.execute(tasks)
+            timings[telemetry] = min(timings.get(telemetry, float("inf")), time.perf_counter() - start)
+            if telemetry:
+                print(tm.stats)
+    print(f"telemetry off: {timings[False]:.3f}s, on: {timings[True]:.3f}s")
+    assert timings[True] < 2 * timings[False], timings